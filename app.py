@@ -1,9 +1,12 @@
+import os
 import streamlit as st
+import time
 import traceback
 
-from intent_classifier import IntentClassifier
-from entity_extractor import extract_crop
-from responder import build_response
+import metrics
+from conversation import ConversationState
+from pipeline import build_pipeline
+from responder import advice_variants
 
 
 st.set_page_config(
@@ -14,66 +17,111 @@ st.set_page_config(
 
 
 @st.cache_resource
-def load_classifier():
-    return IntentClassifier()
+def start_metrics():
+    # METRICS_PORT serves Prometheus text on /metrics; METRICS_FILE writes it.
+    metrics.start_from_env()
+    return metrics.REGISTRY
 
-classifier = load_classifier()
 
-
-
-st.title("🌾 Farmer Advisory Chatbot")
-st.caption(
-    "Ask questions about crops, fertilizers, pests, irrigation, planting, harvesting, diseases, soil, seeds, markets, subsidies, or equipment."
-)
-
-
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-
-# Display previous messages
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
-
-
-user_input = st.chat_input("Type your farming question here...")
-
-
-if user_input:
-    # Show user message
-    st.session_state.messages.append(
-        {"role": "user", "content": user_input}
+@st.cache_resource
+def load_pipeline():
+    # Shared by all sessions: one model, one batching queue, one answer cache.
+    # The model loads in the background so the page renders immediately.
+    return build_pipeline()
+
+start_metrics()
+chat_pipeline = load_pipeline()
+
+# A sampled rerun slower than PROFILE_SLOW_MS is profiled end to end,
+# history rendering included (see profiler.py).
+rerun_started = time.perf_counter()
+rerun_capture = chat_pipeline.profiler.start() if chat_pipeline.profiler is not None else None
+result = {}
+
+
+# Reruns also end early (st.stop, st.rerun or an error); the capture must
+# still be finished or it stays pinned to this script thread.
+try:
+    st.title("🌾 Farmer Advisory Chatbot")
+    st.caption(
+        "Ask questions about crops, fertilizers, pests, irrigation, planting, harvesting, diseases, soil, seeds, markets, subsidies, or equipment."
     )
-    with st.chat_message("user"):
-        st.markdown(user_input)
-
-    try:
-        with st.chat_message("assistant"):
-            with st.spinner("Processing... 🌱"):
-
-                # 🔹 SAME STEPS AS YOUR /query ROUTE
-                intent_res = classifier.predict(user_input)
-                intent = intent_res.get("intent")
-                score = intent_res.get("score")
-
-                crop = extract_crop(user_input)
-                advice = build_response(intent, crop, user_input)
-
-                st.markdown(advice)
-
-        st.session_state.messages.append(
-            {"role": "assistant", "content": advice}
+    if chat_pipeline.load_error():
+        st.error(
+            f"The AI model failed to load ({chat_pipeline.load_error()}) – answers come from the "
+            "quick keyword model until the app is restarted."
         )
-
-    except Exception:
-        traceback.print_exc()
-        error_msg = "Sorry, there was an error processing your query."
-
+    elif not chat_pipeline.is_ready():
+        st.info("The AI model is still loading – answers come from a quick keyword model for now. 🌱")
+
+    # Chat bubbles drawn per rerun; older kept turns collapse into one block.
+    RENDER_TURNS = int(os.environ.get("CHAT_RENDER_TURNS", "10"))
+
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = ConversationState()
+    conversation = st.session_state.conversation
+
+    # Regional/seasonal advice, offered only when the knowledge store has some.
+    region = season = None
+    variants = advice_variants()
+    with st.sidebar:
+        if variants["regions"]:
+            region = st.selectbox("Region", [None] + variants["regions"], format_func=lambda r: r or "Any")
+        if variants["seasons"]:
+            season = st.selectbox("Season", [None] + variants["seasons"], format_func=lambda s: s or "Any")
+
+    def show_turn(query, advice):
+        with st.chat_message("user"):
+            st.markdown(query)
         with st.chat_message("assistant"):
-            st.error(error_msg)
-
-        st.session_state.messages.append(
-            {"role": "assistant", "content": error_msg}
+            st.markdown(advice)
+
+    # Display previous messages
+    if conversation.summary():
+        st.caption(conversation.summary())
+    older = conversation.older_markdown(RENDER_TURNS)
+    if older:
+        with st.expander("Earlier messages"):
+            st.markdown(older)
+    for query, advice, _ in conversation.recent(RENDER_TURNS):
+        show_turn(query, advice)
+
+    user_input = st.chat_input("Type your farming question here...")
+
+    if user_input:
+        with st.chat_message("user"):
+            st.markdown(user_input)
+
+        crop = None
+        result = {"query": user_input}
+        try:
+            with st.chat_message("assistant"):
+                with st.spinner("Processing... 🌱"):
+
+                    # 🔹 SAME STEPS AS YOUR /query ROUTE
+                    result = chat_pipeline.answer(
+                        user_input, context_crop=conversation.last_crop, region=region, season=season
+                    )
+                    advice = result["advice"]
+                    crop = result["crop"]
+
+                    st.markdown(advice)
+
+        except Exception:
+            traceback.print_exc()
+            advice = "Sorry, there was an error processing your query."
+
+            with st.chat_message("assistant"):
+                st.error(advice)
+
+        conversation.add(user_input, advice, crop)
+
+    with st.sidebar:
+        st.caption(
+            f"Session history: {len(conversation.turns)}/{conversation.turns.maxlen} turns, "
+            f"~{conversation.memory_bytes() / 1024:.1f} KiB"
+            + (f"; follow-ups refer to {conversation.last_crop}" if conversation.last_crop else "")
         )
-
+finally:
+    if rerun_capture is not None:
+        chat_pipeline.profiler.finish(rerun_capture, result, {"rerun": 1000 * (time.perf_counter() - rerun_started)})
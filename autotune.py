@@ -0,0 +1,252 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import backends
+from farming_data import SPLITS, load_split
+
+
+DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "autotune_profile.json")
+
+_VARIANTS = ("inference_mode", "torchscript", "compile")
+_MAX_LENGTHS = (32, 64, 128)
+_BATCH_SIZES = (1, 4, 8, 16, 32)
+
+
+def host_info():
+    return {
+        "cpu_count": os.cpu_count() or 1,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+    }
+
+
+def candidate_threads(workers=1):
+    """Powers of two up to this host's cores per worker, plus that count."""
+    limit = max(1, (os.cpu_count() or 1) // workers)
+    counts = {limit}
+    n = 1
+    while n < limit:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def _measure(backend, config, latency_queries=50, repeat=3):
+    """Time one configuration; runs in a fresh process per config.
+
+    Inter-op threads can only be set once per process, and a compiled or
+    traced model shouldn't leak into the next measurement.
+    """
+    try:
+        import torch
+    except ImportError:
+        torch = None  # keyword/rules backends run without it
+    if torch is not None:
+        torch.set_num_threads(config["threads"])
+        torch.set_num_interop_threads(config["interop_threads"])
+    options = {}
+    if backend == "fine-tuned":
+        options = {"variant": config["variant"], "max_length": config["max_length"]}
+    started = time.perf_counter()
+    classifier = backends.create(backend, **options)
+    load_seconds = time.perf_counter() - started
+
+    examples = [example for split in SPLITS for example in load_split(split)]
+    texts = [example["text"] for example in examples]
+    classifier.predict_batch(texts[:config["batch_size"]])
+
+    latencies = []
+    for text in texts[:latency_queries]:
+        t = time.perf_counter()
+        classifier.predict(text)
+        latencies.append(1000 * (time.perf_counter() - t))
+    latencies.sort()
+
+    batch_size = config["batch_size"]
+    predictions = []
+    t = time.perf_counter()
+    for _ in range(repeat):
+        predictions = []
+        for start in range(0, len(texts), batch_size):
+            predictions.extend(result["intent"] for result in classifier.predict_batch(texts[start:start + batch_size]))
+    elapsed = time.perf_counter() - t
+
+    return dict(
+        config,
+        load_seconds=round(load_seconds, 2),
+        p50_ms=round(latencies[len(latencies) // 2], 3),
+        p95_ms=round(latencies[int(0.95 * (len(latencies) - 1))], 3),
+        throughput_qps=round(repeat * len(texts) / elapsed, 1),
+        accuracy=round(sum(p == e["intent"] for p, e in zip(predictions, examples)) / len(examples), 4),
+    )
+
+
+def _run_isolated(backend, config):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        try:
+            result = pool.submit(_measure, backend, config).result()
+        except Exception as e:
+            result = dict(config, error=f"{type(e).__name__}: {e}")
+    if "error" in result:
+        print(f"  {_describe(config)}: skipped ({result['error']})", file=sys.stderr)
+    else:
+        print(f"  {_describe(config)}: p50 {result['p50_ms']}ms, {result['throughput_qps']} q/s, "
+              f"accuracy {result['accuracy']}", file=sys.stderr)
+    return result
+
+
+def _describe(config):
+    return " ".join(f"{key}={value}" for key, value in config.items())
+
+
+def _score(result, objective):
+    # Lower is better for both objectives.
+    return result["p50_ms"] if objective == "latency" else -result["throughput_qps"]
+
+
+def tune(backend="fine-tuned", workers=1, objective="latency", accuracy_drop=0.01):
+    """Sweep inference settings one dimension at a time.
+
+    Threads (intra/inter-op), then model variant and sequence-length cap
+    (fine-tuned models only), then batch size, each stage keeping the best
+    setting for ``objective`` so far; the best measured configuration for
+    the other objective is recorded too. Settings that lose more than
+    ``accuracy_drop`` accuracy against the first measurement are rejected.
+    Returns the profile dict written by ``save_profile``.
+    """
+    results = []
+    best = {"threads": 1, "interop_threads": 1, "batch_size": 16}
+    if backend == "fine-tuned":
+        best.update(variant="inference_mode", max_length=128)
+    baseline = None
+
+    def stage(name, configs, by=objective):
+        nonlocal best, baseline
+        print(f"Stage {name}", file=sys.stderr)
+        measured = [_run_isolated(backend, config) for config in configs]
+        results.extend(measured)
+        ok = [r for r in measured if "error" not in r]
+        if baseline is None and ok:
+            baseline = max(r["accuracy"] for r in ok)
+        ok = [r for r in ok if baseline is None or r["accuracy"] >= baseline - accuracy_drop]
+        if ok:
+            winner = min(ok, key=lambda r: _score(r, by))
+            best = {key: winner[key] for key in best}
+
+    stage("threads", [
+        dict(best, threads=threads, interop_threads=interop)
+        for threads in candidate_threads(workers) for interop in (1, 2)
+    ])
+    if backend == "fine-tuned":
+        stage("variant", [dict(best, variant=variant) for variant in _VARIANTS])
+        stage("max_length", [dict(best, max_length=length) for length in _MAX_LENGTHS])
+    # Batch size only changes throughput; single-query latency doesn't see it.
+    stage("batch_size", [dict(best, batch_size=size) for size in _BATCH_SIZES], by="throughput")
+
+    ok = [r for r in results if "error" not in r and r["accuracy"] >= (baseline or 0) - accuracy_drop]
+    if not ok:
+        raise RuntimeError(f"No {backend} configuration could be measured")
+    other = "throughput" if objective == "latency" else "latency"
+    return {
+        "host": host_info(),
+        "backend": backend,
+        "workers": workers,
+        "objective": objective,
+        "best": {
+            objective: best,
+            other: {key: min(ok, key=lambda r: _score(r, other))[key] for key in best},
+        },
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def save_profile(profile, path=DEFAULT_PROFILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+
+
+def load_profile(path=None, backend=None):
+    """The AUTOTUNE_PROFILE (default autotune_profile.json), if tuned on a host like this one.
+
+    The profile must also have been tuned for ``backend`` (default: the
+    one ``backends.create()`` builds); settings for another model don't
+    carry over.
+    """
+    path = path or os.environ.get("AUTOTUNE_PROFILE", DEFAULT_PROFILE)
+    backend = backend or backends.default_backend()
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    if profile["host"]["cpu_count"] != host_info()["cpu_count"]:
+        print(f"Ignoring autotune profile {path}: tuned for {profile['host']['cpu_count']} cores, "
+              f"this host has {host_info()['cpu_count']}")
+        return None
+    if profile["backend"] != backend:
+        print(f"Ignoring autotune profile {path}: tuned for the {profile['backend']} backend, "
+              f"this app uses {backend}")
+        return None
+    return profile
+
+
+def profile_threads(workers, path=None):
+    """Tuned torch threads for ``workers`` processes per host, or None."""
+    profile = load_profile(path)
+    if profile is None or profile["workers"] != workers:
+        return None
+    return profile["best"][profile["objective"]]["threads"]
+
+
+def apply_profile(path=None):
+    """Apply a saved profile to this process at start-up.
+
+    Sets torch threads and, where not already set in the environment,
+    BATCH_MAX_SIZE and the fine-tuned model's INTENT_VARIANT and
+    INTENT_MAX_LENGTH. Returns the applied settings, or None.
+    """
+    profile = load_profile(path)
+    if profile is None:
+        return None
+    config = profile["best"][profile["objective"]]
+    os.environ.setdefault("BATCH_MAX_SIZE", str(config["batch_size"]))
+    if profile["backend"] == "fine-tuned":
+        os.environ.setdefault("INTENT_VARIANT", config["variant"])
+        os.environ.setdefault("INTENT_MAX_LENGTH", str(config["max_length"]))
+    try:
+        import torch
+
+        torch.set_num_threads(config["threads"])
+        torch.set_num_interop_threads(config["interop_threads"])
+    except (ImportError, RuntimeError) as e:
+        # Inter-op threads can't change once torch has run parallel work.
+        print(f"Autotune profile: couldn't set torch threads ({e})")
+    print(f"Applied autotune profile ({profile['backend']}, {profile['objective']}): {_describe(config)}")
+    return config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune CPU inference settings for this host")
+    parser.add_argument("--backend", default="fine-tuned", help="backends.py name (zero-shot, fine-tuned, ...)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes that will share this host; threads are tuned per process")
+    parser.add_argument("--objective", choices=["latency", "throughput"], default="latency",
+                        help="which best configuration the app applies")
+    parser.add_argument("--accuracy-drop", type=float, default=0.01,
+                        help="reject settings losing more accuracy than this")
+    parser.add_argument("--output", default=os.environ.get("AUTOTUNE_PROFILE", DEFAULT_PROFILE))
+    args = parser.parse_args()
+
+    profile = tune(args.backend, args.workers, args.objective, args.accuracy_drop)
+    save_profile(profile, args.output)
+    for objective, config in profile["best"].items():
+        print(f"Best for {objective}: {_describe(config)}")
+    print(f"Profile written to {args.output}")
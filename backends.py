@@ -0,0 +1,251 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from farming_data import load_split
+from sysinfo import rss_mb
+
+
+# name -> (factory, description); factories read their options from the
+# environment and import their model code lazily.
+_REGISTRY = {}
+
+
+def register(name, description=""):
+    """Decorator adding a classifier factory to the registry under ``name``."""
+    def decorator(factory):
+        _REGISTRY[name] = (factory, description)
+        return factory
+    return decorator
+
+
+def available():
+    """Registered backend names and their descriptions."""
+    return {name: description for name, (_, description) in _REGISTRY.items()}
+
+
+def default_backend():
+    """INTENT_BACKEND, or "cascade" if the older INTENT_CASCADE flag is set."""
+    if os.environ.get("INTENT_BACKEND"):
+        return os.environ["INTENT_BACKEND"]
+    return "cascade" if os.environ.get("INTENT_CASCADE") else "zero-shot"
+
+
+def create(name=None, **options):
+    """Build the named backend (default: ``default_backend()``)."""
+    name = name or default_backend()
+    if name not in _REGISTRY:
+        raise ValueError(f"Unknown intent backend {name!r}; choose from {', '.join(_REGISTRY)}")
+    return _REGISTRY[name][0](**options)
+
+
+def normalize_result(result):
+    """Coerce a backend result to ``{"intent", "score", "all": [{"intent", "score"}]}``.
+
+    ``all`` is sorted by descending score; (intent, score) tuples, as
+    FarmingIntentClassifier returns them, become dicts. Extra keys such as
+    ``error``, ``fallback`` or ``stage`` are kept.
+    """
+    entries = [
+        item if isinstance(item, dict) else {"intent": item[0], "score": float(item[1])}
+        for item in result.get("all") or []
+    ]
+    entries.sort(key=lambda item: -item["score"])
+    return dict(result, score=float(result.get("score") or 0.0), all=entries)
+
+
+class NormalizedClassifier:
+    """Wraps a classifier so every result follows the common schema."""
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+
+    def predict(self, text):
+        return normalize_result(self.classifier.predict(text))
+
+    def predict_batch(self, texts):
+        if hasattr(self.classifier, "predict_batch"):
+            results = self.classifier.predict_batch(list(texts))
+        else:
+            results = [self.classifier.predict(text) for text in texts]
+        return [normalize_result(result) for result in results]
+
+
+@register("zero-shot", "facebook/bart-large-mnli zero-shot (INTENT_MODEL_PATH or local snapshot)")
+def _zero_shot(model=None):
+    from intent_classifier import IntentClassifier
+    from model_loader import default_model_path
+    return IntentClassifier(model or default_model_path())
+
+
+@register("embedding", "sentence-embedding similarity to intent descriptions")
+def _embedding(model_name=None):
+    from intent_classifier import EmbeddingIntentClassifier
+    return EmbeddingIntentClassifier(model_name) if model_name else EmbeddingIntentClassifier()
+
+
+@register("keyword", "TF-IDF + logistic regression trained at start-up")
+def _keyword():
+    from intent_classifier import KeywordIntentClassifier
+    return KeywordIntentClassifier()
+
+
+@register("rules", "keyword rules, no model; the degraded path under LATENCY_BUDGET_MS")
+def _rules():
+    from intent_classifier import RuleIntentClassifier
+    return RuleIntentClassifier()
+
+
+@register("fine-tuned", "DistilBERT from train_snips.py or distill.py (INTENT_MODEL_DIR)")
+def _fine_tuned(model_dir=None, variant=None, max_length=None):
+    from intent_classifier import FineTunedIntentClassifier
+    return FineTunedIntentClassifier(
+        model_dir or os.environ.get("INTENT_MODEL_DIR", "./farming_model"),
+        variant=variant or os.environ.get("INTENT_VARIANT", "inference_mode"),
+        max_length=max_length or int(os.environ.get("INTENT_MAX_LENGTH", "128")),
+    )
+
+
+@register("onnx", "fine-tuned model exported by onnx_classifier.py (ONNX_MODEL_DIR)")
+def _onnx(model_dir=None, quantized=None):
+    from onnx_classifier import OnnxFarmingIntentClassifier
+    if quantized is None:
+        quantized = os.environ.get("ONNX_QUANTIZED", "1") != "0"
+    return NormalizedClassifier(OnnxFarmingIntentClassifier(
+        model_dir or os.environ.get("ONNX_MODEL_DIR", "./farming_model_onnx"), quantized=quantized
+    ))
+
+
+@register("cascade", "keyword model, escalating to CASCADE_SECOND_STAGE below CASCADE_THRESHOLD")
+def _cascade(threshold=None, second_stage=None):
+    from intent_classifier import CascadeClassifier
+    # Built now, not on the first escalation: warm-up rarely escalates, and a
+    # lazy load would stall the batching thread on the first ambiguous query.
+    second_stage = second_stage or os.environ.get("CASCADE_SECOND_STAGE", "zero-shot")
+    return CascadeClassifier(
+        second_stage=create(second_stage) if isinstance(second_stage, str) else second_stage,
+        threshold=threshold if threshold is not None else float(os.environ.get("CASCADE_THRESHOLD", "0.7")),
+    )
+
+
+@register("fake", "deterministic stand-in with FAKE_MODEL_LATENCY_MS latency, for offline runs")
+def _fake(latency_ms=None):
+    from intent_classifier import FakeIntentClassifier
+    if latency_ms is None:
+        latency_ms = float(os.environ.get("FAKE_MODEL_LATENCY_MS", "20"))
+    return FakeIntentClassifier(latency_ms=latency_ms)
+
+
+def parameter_count(classifier):
+    """Parameters of the torch model behind a backend, or None."""
+    for attr in ("classifier", "model"):
+        inner = getattr(classifier, attr, None)
+        # NormalizedClassifier -> backend, FineTunedIntentClassifier ->
+        # FarmingIntentClassifier, zero-shot pipeline -> model.
+        for candidate in (inner, getattr(inner, "model", None)):
+            if hasattr(candidate, "parameters"):
+                return sum(p.numel() for p in candidate.parameters())
+    return None
+
+
+def evaluate(classifier_or_factory, splits=("validation", "test")):
+    """Accuracy, macro-F1, latency and load memory of one backend.
+
+    Returns ``(predictions, stats)``; latency is per single-query
+    ``predict`` call after one warm-up call.
+    """
+    from sklearn.metrics import f1_score
+
+    before = rss_mb()
+    classifier = classifier_or_factory() if callable(classifier_or_factory) else classifier_or_factory
+    load_mb = rss_mb() - before
+
+    examples = [example for split in splits for example in load_split(split)]
+    classifier.predict(examples[0]["text"])
+    predictions, latencies = [], []
+    for example in examples:
+        start = time.perf_counter()
+        predictions.append(classifier.predict(example["text"])["intent"])
+        latencies.append(1000 * (time.perf_counter() - start))
+
+    gold = [example["intent"] for example in examples]
+    latencies.sort()
+    return predictions, {
+        "examples": len(examples),
+        "accuracy": round(sum(p == g for p, g in zip(predictions, gold)) / len(gold), 4),
+        "macro_f1": round(float(f1_score(gold, predictions, average="macro", zero_division=0)), 4),
+        "mean_latency_ms": round(sum(latencies) / len(latencies), 3),
+        "p99_latency_ms": round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))], 3),
+        "load_rss_mb": round(load_mb, 1),
+        "rss_mb": round(rss_mb(), 1),
+        "parameters": parameter_count(classifier),
+    }
+
+
+def _evaluate_named(name, splits):
+    try:
+        return evaluate(lambda: create(name), splits)[1]
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def evaluate_all(names=None, splits=("validation", "test"), isolate=True):
+    """Evaluate backends, each in a fresh process so memory numbers don't mix."""
+    names = names or list(_REGISTRY)
+    report = {}
+    for name in names:
+        print(f"Evaluating {name}...", file=sys.stderr)
+        if isolate:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                report[name] = pool.submit(_evaluate_named, name, splits).result()
+        else:
+            report[name] = _evaluate_named(name, splits)
+    return report
+
+
+def print_report(report, min_accuracy=None):
+    print(f"{'backend':12s} {'accuracy':>8s} {'macroF1':>8s} {'mean ms':>9s} {'p99 ms':>9s} {'load MB':>8s}")
+    for name, stats in report.items():
+        if "error" in stats:
+            print(f"{name:12s} skipped: {stats['error']}")
+            continue
+        print(f"{name:12s} {stats['accuracy']:8.3f} {stats['macro_f1']:8.3f} {stats['mean_latency_ms']:9.2f} "
+              f"{stats['p99_latency_ms']:9.2f} {stats['load_rss_mb']:8.1f}")
+    if min_accuracy is not None:
+        passing = [(stats["mean_latency_ms"], name) for name, stats in report.items()
+                   if "error" not in stats and stats["accuracy"] >= min_accuracy]
+        if passing:
+            print(f"Fastest backend with accuracy >= {min_accuracy}: {min(passing)[1]}")
+        else:
+            print(f"No backend reaches accuracy {min_accuracy}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Intent classifier backends")
+    parser.add_argument("command", choices=["list", "evaluate"])
+    parser.add_argument("--backends", default=None, help="comma-separated (default: all registered)")
+    parser.add_argument("--splits", default="validation,test")
+    parser.add_argument("--min-accuracy", type=float, default=None,
+                        help="also name the fastest backend meeting this accuracy")
+    parser.add_argument("--no-isolate", action="store_true", help="evaluate every backend in this process")
+    parser.add_argument("--output", default=None, help="also write the report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for name, description in available().items():
+            print(f"{name:12s} {description}")
+    else:
+        report = evaluate_all(
+            args.backends.split(",") if args.backends else None,
+            tuple(args.splits.split(",")),
+            isolate=not args.no_isolate,
+        )
+        print_report(report, args.min_accuracy)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+import metrics
+
+
+def length_buckets(texts, batch_size):
+    """Yield lists of indices into ``texts``, grouped by similar length.
+
+    Sorting by length before chunking means each batch is padded only to
+    its own longest member instead of the longest text overall.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for start in range(0, len(order), batch_size):
+        yield order[start:start + batch_size]
+
+
+# Seconds of worker idleness that halve the batch-time estimate.
+_ESTIMATE_HALF_LIFE = 1.0
+
+
+class _Request:
+    __slots__ = ("text", "future", "enqueued_at")
+
+    def __init__(self, text):
+        self.text = text
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchingScheduler:
+    """Micro-batching front end for a classifier with ``predict_batch``.
+
+    Concurrent callers ``submit`` single queries; a background thread collects
+    them for at most ``max_wait_ms`` (or until ``max_batch_size`` queries are
+    waiting) and runs them through the model as one padded batch. Each caller
+    gets a future resolving to the usual ``{"intent", "score", "all"}`` dict.
+    """
+
+    def __init__(self, classifier, max_batch_size=16, max_wait_ms=10):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._batch_sizes = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits = deque(maxlen=1000)
+        # Moving average of model time per batch, for wait estimates. It
+        # halves every ``_ESTIMATE_HALF_LIFE`` seconds the worker sits idle,
+        # so a few slow batches don't keep the estimate high forever.
+        self._batch_seconds = 0.0
+        self._idle_since = time.perf_counter()
+        self._busy = False
+
+        self._worker = threading.Thread(
+            target=self._run, name="intent-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, text):
+        """Queue a query and return a future for its result dict."""
+        request = _Request(text)
+        # Checked and queued together so nothing lands behind close()'s sentinel.
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchingScheduler is closed")
+            self._queue.put(request)
+        return request.future
+
+    def predict(self, text, timeout=None):
+        """Blocking convenience wrapper with the same signature as ``predict``."""
+        return self.submit(text).result(timeout=timeout)
+
+    def predict_batch(self, texts, timeout=None):
+        """Queue several queries at once and wait for all their results."""
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def estimated_wait(self):
+        """Rough seconds until a query submitted now has its result.
+
+        Batches already queued ahead of it, plus its own, at the recent
+        average model time per batch, plus the collection wait.
+        """
+        batches_ahead = self._queue.qsize() // self.max_batch_size + 1
+        return batches_ahead * self._current_batch_seconds() + self.max_wait
+
+    def is_idle(self):
+        """Nothing queued and no batch running."""
+        return not self._busy and self._queue.empty()
+
+    def _current_batch_seconds(self):
+        if self._busy or not self._batch_seconds:
+            return self._batch_seconds
+        idle = time.perf_counter() - self._idle_since
+        return self._batch_seconds * 0.5 ** (idle / _ESTIMATE_HALF_LIFE)
+
+    def close(self):
+        """Stop the worker after the queued requests have been served."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def stats(self):
+        """Return batch-size and queue-wait statistics."""
+        with self._lock:
+            waits = sorted(self._recent_waits)
+            batches = self._batches
+            requests = self._requests
+            return {
+                "batches": batches,
+                "requests": requests,
+                "mean_batch_size": requests / batches if batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "mean_queue_wait_ms": 1000 * self._wait_total / requests if requests else 0.0,
+                "p95_queue_wait_ms": 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                "max_queue_wait_ms": 1000 * self._wait_max,
+                "queue_depth": self._queue.qsize(),
+                "mean_batch_ms": 1000 * self._batch_seconds,
+            }
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    request = self._queue.get(timeout=remaining)
+                else:
+                    request = self._queue.get_nowait()
+            except Empty:
+                break
+            if request is None:
+                # Re-queue the sentinel so the loop exits after this batch.
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _record(self, batch, started):
+        metrics.REGISTRY.histogram(
+            "model_batch_size", "Queries per model batch", buckets=metrics.BATCH_SIZE_BUCKETS
+        ).observe(len(batch))
+        queue_wait = metrics.REGISTRY.histogram("model_queue_wait_seconds", "Time queries wait for a batch")
+        for request in batch:
+            queue_wait.observe(started - request.enqueued_at)
+        with self._lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            for request in batch:
+                wait = started - request.enqueued_at
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._recent_waits.append(wait)
+
+    def _fail_leftovers(self):
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except Empty:
+                return
+            if request is not None and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(RuntimeError("BatchingScheduler is closed"))
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._fail_leftovers()
+                break
+            batch = self._collect(first)
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            self._record(batch, started)
+            previous = self._current_batch_seconds()
+            self._busy = True
+            try:
+                results = self.classifier.predict_batch([r.text for r in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                self._busy = False
+                self._idle_since = time.perf_counter()
+            elapsed = time.perf_counter() - started
+            self._batch_seconds = elapsed if not previous else 0.8 * previous + 0.2 * elapsed
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+    from intent_classifier import IntentClassifier
+
+    scheduler = BatchingScheduler(IntentClassifier(), max_batch_size=8, max_wait_ms=20)
+    queries = [
+        "Which fertilizer should I use for maize?",
+        "How to control aphids on wheat",
+        "When to harvest potatoes",
+        "Drip irrigation for tomato",
+    ] * 4
+    with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+        for q, res in zip(queries, pool.map(scheduler.predict, queries)):
+            print(f"{q} -> {res['intent']} ({res['score']:.3f})")
+    print(scheduler.stats())
+    scheduler.close()
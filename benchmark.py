@@ -0,0 +1,237 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import BatchingScheduler
+from entity_extractor import extract_crop
+from farming_data import SPLITS, load_split
+from intent_classifier import FakeIntentClassifier
+from pipeline import ChatPipeline
+from query_cache import QueryCache
+from responder import build_response
+from sysinfo import peak_rss_mb, rss_mb
+
+
+# Per-case latency metrics where higher is worse.
+_LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+_TEMPLATES = [
+    "Which fertilizer should I use for {crop}?",
+    "How do I control pests on my {crop}",
+    "how much water does {crop} need in summer",
+    "When is the best time to plant {crop}?",
+    "my {crop} leaves are turning yellow what to do",
+    "best time to harvest {crop}",
+    "tell me about {crop} farming",
+    "aphids on {crop}, which spray is safe",
+]
+_SYNTHETIC_CROPS = ["maize", "wheat", "rice", "tomato", "potato", "cotton", "onion",
+                    "corn", "paddy", "brinjal", "tomatos", "whaet", "sugar cane", "groundnut"]
+
+
+def dataset_texts():
+    return [example["text"] for split in SPLITS for example in load_split(split)]
+
+
+def synthetic_texts(n=500, seed=0):
+    """Template queries over crops, synonyms and misspellings; deterministic per seed."""
+    rng = random.Random(seed)
+    return [rng.choice(_TEMPLATES).format(crop=rng.choice(_SYNTHETIC_CROPS)) for _ in range(n)]
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles (ms) and throughput for one benchmark case."""
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean_ms": round(1000 * sum(latencies) / len(latencies), 4),
+        "p50_ms": round(1000 * _percentile(latencies, 0.50), 4),
+        "p95_ms": round(1000 * _percentile(latencies, 0.95), 4),
+        "p99_ms": round(1000 * _percentile(latencies, 0.99), 4),
+        "throughput_qps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def time_calls(func, items, repeat=1):
+    """Call ``func(item)`` for every item, one at a time."""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            t = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def time_concurrent(func, items, concurrency):
+    """Call ``func(item)`` from ``concurrency`` threads; latency is per call."""
+    def call(item):
+        t = time.perf_counter()
+        func(item)
+        return time.perf_counter() - t
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, items))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def _stage_cases(texts):
+    intents = [example["intent"] for split in SPLITS for example in load_split(split)]
+    crops = [extract_crop(text) for text in texts]
+    cases = [(intents[i % len(intents)], crop, text) for i, (crop, text) in enumerate(zip(crops, texts))]
+    return {
+        "extract_crop": (extract_crop, texts),
+        "build_response": (lambda case: build_response(*case), cases),
+    }
+
+
+def _backends(names, latency_ms):
+    import backends
+
+    for name in names:
+        try:
+            if name == "fake":
+                yield name, backends.create("fake", latency_ms=latency_ms)
+            elif name == "cascade":
+                second_stage = backends.create("fake", latency_ms=latency_ms)
+                yield name, backends.create("cascade", second_stage=second_stage)
+            else:
+                yield name, backends.create(name)
+        except Exception as e:
+            print(f"Skipping backend {name}: {e}", file=sys.stderr)
+
+
+def run(backends=("fake", "keyword", "cascade"), concurrency=(1, 4, 16), latency_ms=20.0,
+        synthetic=500, repeat=3, seed=0):
+    """Benchmark each stage, each classifier backend and the full pipeline.
+
+    Returns a JSON-serializable dict; ``results`` maps case names like
+    ``stage/extract_crop`` or ``pipeline/c16`` to latency and throughput.
+    """
+    texts = dataset_texts() + synthetic_texts(synthetic, seed)
+    results = {}
+    memory = {"start_rss_mb": round(rss_mb(), 1)}
+
+    for name, (func, items) in _stage_cases(texts).items():
+        results[f"stage/{name}"] = time_calls(func, items, repeat)
+
+    for name, classifier in _backends(backends, latency_ms):
+        # Model-backed classifiers get a slice; it still covers every intent.
+        items = texts if name == "keyword" else texts[:100]
+        results[f"classifier/{name}"] = time_calls(classifier.predict, items)
+        memory[f"after_{name}_rss_mb"] = round(rss_mb(), 1)
+
+    # Cache off so every query reaches the (fake) model through the batcher.
+    scheduler = BatchingScheduler(FakeIntentClassifier(latency_ms=latency_ms), max_batch_size=16, max_wait_ms=5)
+    pipeline = ChatPipeline(scheduler)
+    for level in concurrency:
+        results[f"pipeline/c{level}"] = time_concurrent(pipeline.answer, texts, level)
+    results["pipeline/batching"] = {
+        key: round(value, 3) for key, value in scheduler.stats().items() if isinstance(value, (int, float))
+    }
+    scheduler.close()
+
+    cached = ChatPipeline(FakeIntentClassifier(latency_ms=latency_ms), cache=QueryCache())
+    cached.answer_batch(texts)
+    # The warm-up's misses aren't part of the measured hit rate.
+    cached.cache.reset_stats()
+    results["pipeline/cached"] = time_calls(cached.answer, texts, repeat)
+    results["pipeline/cached"]["hit_rate"] = round(cached.cache.stats()["hit_rate"], 3)
+
+    memory["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "fake_latency_ms": latency_ms,
+            "queries": len(texts),
+            "seed": seed,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "memory": memory,
+        "results": results,
+    }
+
+
+def _ms_per_query(qps):
+    return 1000.0 / qps if qps > 0 else float("inf")
+
+
+def compare(current, baseline, tolerance=0.2, min_delta_ms=0.5):
+    """List regressions of more than ``tolerance`` against a baseline run.
+
+    Latency percentiles regress when they grow by more than ``tolerance``
+    and by at least ``min_delta_ms``; throughput when it drops by more
+    than ``tolerance`` and the time per query grows by at least
+    ``min_delta_ms``. That way microsecond jitter on cheap cases isn't
+    flagged. Peak memory regresses when it grows.
+    """
+    regressions = []
+    for case, stats in current["results"].items():
+        before = baseline.get("results", {}).get(case)
+        if not before:
+            continue
+        for key in _LATENCY_KEYS:
+            if (key in stats and before.get(key) and stats[key] > before[key] * (1 + tolerance)
+                    and stats[key] - before[key] >= min_delta_ms):
+                regressions.append(f"{case} {key}: {before[key]} -> {stats[key]}")
+        key = "throughput_qps"
+        if (key in stats and before.get(key) and stats[key] < before[key] * (1 - tolerance)
+                and _ms_per_query(stats[key]) - _ms_per_query(before[key]) >= min_delta_ms):
+            regressions.append(f"{case} {key}: {before[key]} -> {stats[key]}")
+    old_peak = baseline.get("memory", {}).get("peak_rss_mb")
+    new_peak = current["memory"]["peak_rss_mb"]
+    if old_peak and new_peak > old_peak * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {old_peak} -> {new_peak}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark for the chatbot pipeline")
+    parser.add_argument("--backends", default="fake,keyword,cascade",
+                        help="comma-separated names from backends.py (cascade escalates to fake)")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--fake-latency-ms", type=float, default=20.0)
+    parser.add_argument("--synthetic", type=int, default=500, help="synthetic queries added to the dataset")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a saved run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="ignore latency or per-query time increases smaller than this, whatever the ratio")
+    args = parser.parse_args()
+
+    report = run(
+        backends=args.backends.split(","),
+        concurrency=[int(c) for c in args.concurrency.split(",")],
+        latency_ms=args.fake_latency_ms,
+        synthetic=args.synthetic,
+        repeat=args.repeat,
+        seed=args.seed,
+    )
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    for case, stats in report["results"].items():
+        print(f"{case:24s} {json.dumps(stats)}")
+    print(f"Peak RSS: {report['memory']['peak_rss_mb']} MiB; results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline.")
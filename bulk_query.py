@@ -0,0 +1,187 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+
+from pipeline import ChatPipeline, build_classifier
+from prefork import load_shared_classifier
+from query_cache import QueryCache
+
+
+# Workers must be forked to inherit the parent's loaded model.
+_FORK = multiprocessing.get_context("fork")
+# Classifier loaded in the parent before the pool forks; workers share its
+# weights copy-on-write instead of each loading a copy.
+_CLASSIFIER = None
+# Per-process pipeline, built once by the pool initializer.
+_PIPELINE = None
+# Answer fields written per record; scores and timings stay out of the dump.
+_OUTPUT_FIELDS = ("intent", "intent_score", "crop", "advice")
+
+
+def read_records(path, text_field="text", start=0):
+    """Stream ``(offset, record)`` pairs from a JSONL or CSV file.
+
+    Records before ``start`` are skipped without being parsed. A JSONL line
+    may be an object or a bare string; CSV needs a header row.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (line for line in f if line.strip())
+        for offset, row in enumerate(rows):
+            if offset < start:
+                continue
+            if isinstance(row, str):
+                row = json.loads(row)
+                if isinstance(row, str):
+                    row = {text_field: row}
+            yield offset, row
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker(threads):
+    global _PIPELINE
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    # Dumps repeat the same questions a lot; each worker keeps its own cache.
+    _PIPELINE = ChatPipeline(_CLASSIFIER or build_classifier(), cache=QueryCache(maxsize=65536, ttl=float("inf")))
+
+
+def _process_chunk(chunk, text_field, batch_size):
+    """Answer one chunk of records in model batches of ``batch_size``."""
+    out = []
+    for start in range(0, len(chunk), batch_size):
+        batch = chunk[start:start + batch_size]
+        texts = [str(record.get(text_field) or "") for _, record in batch]
+        for (offset, record), answer in zip(batch, _PIPELINE.answer_batch(texts)):
+            row = dict(record, offset=offset)
+            row.update((key, answer.get(key)) for key in _OUTPUT_FIELDS)
+            out.append(row)
+    return out
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(path, offset, output_bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"offset": offset, "output_bytes": output_bytes}, f)
+    os.replace(tmp_path, path)
+
+
+class _Progress:
+    def __init__(self, done, interval=5.0):
+        self.started = time.perf_counter()
+        self.start_count = done
+        self.done = done
+        self.interval = interval
+        self._last = self.started
+
+    def update(self, n, force=False):
+        self.done += n
+        now = time.perf_counter()
+        if force or now - self._last >= self.interval:
+            self._last = now
+            elapsed = now - self.started
+            rate = (self.done - self.start_count) / elapsed if elapsed else 0.0
+            print(f"{self.done} queries done, {rate:.1f} q/s, {elapsed:.0f}s elapsed", file=sys.stderr, flush=True)
+
+
+def run(input_path, output_path, text_field="text", workers=None, chunk_size=256, batch_size=32,
+        resume=True, checkpoint_path=None):
+    """Answer every record of ``input_path`` into ``output_path`` (JSONL).
+
+    Chunks of ``chunk_size`` records go to a pool of ``workers`` processes,
+    each with its own pipeline around one classifier loaded before the
+    pool forks (as in prefork.py); at most two chunks per worker are in
+    flight, so memory stays flat however large the input is. Results are
+    written in input order and a checkpoint (records done, output size) is
+    saved after every chunk, so an interrupted run resumes where it stopped.
+    """
+    global _CLASSIFIER
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    checkpoint = _load_checkpoint(checkpoint_path) if resume else None
+    offset = checkpoint["offset"] if checkpoint else 0
+
+    out = open(output_path, "a" if checkpoint else "w", encoding="utf-8")
+    if checkpoint:
+        # Drop anything written after the last checkpoint.
+        out.truncate(checkpoint["output_bytes"])
+        print(f"Resuming {input_path} at record {offset}", file=sys.stderr)
+
+    progress = _Progress(offset)
+    chunks = _chunks(read_records(input_path, text_field, offset), chunk_size)
+
+    def write(rows):
+        nonlocal offset
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        out.flush()
+        offset += len(rows)
+        _save_checkpoint(checkpoint_path, offset, out.tell())
+        progress.update(len(rows))
+
+    try:
+        if workers <= 0:
+            _init_worker(os.cpu_count() or 1)
+            for chunk in chunks:
+                write(_process_chunk(chunk, text_field, batch_size))
+        else:
+            _CLASSIFIER = load_shared_classifier()
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            with _FORK.Pool(workers, initializer=_init_worker, initargs=(threads,)) as pool:
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append(pool.apply_async(_process_chunk, (chunk, text_field, batch_size)))
+                    if len(in_flight) >= 2 * workers:
+                        write(in_flight.popleft().get())
+                while in_flight:
+                    write(in_flight.popleft().get())
+    finally:
+        out.close()
+    progress.update(0, force=True)
+    return offset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL/CSV dump of farmer questions offline")
+    parser.add_argument("input", help="JSONL or .csv file of queries")
+    parser.add_argument("output", help="JSONL file of answers")
+    parser.add_argument("--text-field", default="text", help="field/column holding the question")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: CPU count; 0 runs in this process)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="records sent to a worker at a time")
+    parser.add_argument("--batch-size", type=int, default=32, help="queries per model call")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: OUTPUT.checkpoint)")
+    args = parser.parse_args()
+
+    total = run(args.input, args.output, args.text_field, args.workers, args.chunk_size,
+                args.batch_size, resume=not args.restart, checkpoint_path=args.checkpoint)
+    print(f"Wrote answers for {total} queries to {args.output}")
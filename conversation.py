@@ -0,0 +1,68 @@
+import os
+import sys
+from collections import Counter, deque
+
+
+class ConversationState:
+    """Capped per-session chat history plus the crop follow-ups refer to.
+
+    Turns are ``(query, advice, crop)`` tuples in a ring buffer of
+    ``max_turns``; older turns are dropped and only counted per crop, so a
+    session's memory stays flat however long it runs. ``last_crop`` is the
+    crop of the most recent turn that had one.
+    """
+
+    def __init__(self, max_turns=None):
+        if max_turns is None:
+            max_turns = int(os.environ.get("CHAT_HISTORY_TURNS", "50"))
+        self.turns = deque(maxlen=max(1, max_turns))
+        self.last_crop = None
+        self.earlier = 0
+        self.earlier_crops = Counter()
+        self._transcript = {}
+
+    def add(self, query, advice, crop=None):
+        if len(self.turns) == self.turns.maxlen:
+            _, _, old_crop = self.turns[0]
+            self.earlier += 1
+            if old_crop:
+                self.earlier_crops[old_crop] += 1
+            self._transcript.clear()
+        self.turns.append((query, advice, crop))
+        if crop:
+            self.last_crop = crop
+
+    def recent(self, n):
+        """The last ``n`` turns, oldest first."""
+        return list(self.turns)[-n:] if n > 0 else []
+
+    def older_markdown(self, n):
+        """All but the last ``n`` kept turns as one markdown block.
+
+        Rendering them as a single element is far cheaper than one chat
+        bubble per message; the text is cached until the buffer wraps.
+        """
+        count = max(0, len(self.turns) - n)
+        if count not in self._transcript:
+            self._transcript.clear()
+            self._transcript[count] = "\n\n".join(
+                f"**You:** {query}\n\n{advice}" for query, advice, _ in list(self.turns)[:count]
+            )
+        return self._transcript[count]
+
+    def summary(self):
+        """One line about turns that fell out of the buffer, or ''."""
+        if not self.earlier:
+            return ""
+        line = f"{self.earlier} earlier question{'s' if self.earlier != 1 else ''} not kept"
+        if self.earlier_crops:
+            line += " (mostly about " + ", ".join(crop for crop, _ in self.earlier_crops.most_common(3)) + ")"
+        return line
+
+    def memory_bytes(self):
+        """Approximate size of the kept history, in bytes."""
+        size = sys.getsizeof(self.turns) + sys.getsizeof(self.earlier_crops)
+        for turn in self.turns:
+            size += sys.getsizeof(turn) + sum(sys.getsizeof(field) for field in turn if field is not None)
+        size += sum(sys.getsizeof(text) for text in self._transcript.values())
+        return size
@@ -0,0 +1,219 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmark import synthetic_texts
+from bulk_query import read_records
+from farming_data import load_split
+
+
+_SOFT_LABEL_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "soft_labels")
+
+
+def unlabeled_texts(paths=(), text_field="text", synthetic=500, seed=0):
+    """Unlabeled queries for the teacher: JSONL/CSV dumps plus synthetic ones."""
+    texts = []
+    for path in paths:
+        texts.extend(str(record.get(text_field) or "") for _, record in read_records(path, text_field))
+    texts.extend(synthetic_texts(synthetic, seed))
+    seen = set()
+    return [t for t in texts if t.strip() and not (t in seen or seen.add(t))]
+
+
+def soft_labels(teacher, texts, intents, batch_size=16):
+    """Teacher probabilities over ``intents`` for every text, as an array.
+
+    Results are cached on disk by text set and intent list, since the
+    teacher pass is by far the slowest part of distillation.
+    """
+    key = hashlib.sha1(json.dumps([intents, texts]).encode("utf-8")).hexdigest()
+    cache_path = os.path.join(_SOFT_LABEL_CACHE, f"{key}.npy")
+    if os.path.exists(cache_path):
+        print(f"Using cached teacher labels {cache_path}")
+        return np.load(cache_path)
+
+    print(f"Labelling {len(texts)} texts with the teacher...")
+    probs = np.zeros((len(texts), len(intents)), dtype=np.float32)
+    column = {intent: j for j, intent in enumerate(intents)}
+    started = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        for i, result in enumerate(teacher.predict_batch(texts[start:start + batch_size]), start):
+            for entry in result["all"]:
+                if entry["intent"] in column:
+                    probs[i, column[entry["intent"]]] = entry["score"]
+        print(f"  {min(start + batch_size, len(texts))}/{len(texts)} ({time.perf_counter() - started:.0f}s)")
+    # Rows of failed teacher calls fall back to uniform.
+    totals = probs.sum(axis=1, keepdims=True)
+    probs = np.where(totals > 0, probs / np.maximum(totals, 1e-12), 1.0 / len(intents))
+
+    os.makedirs(_SOFT_LABEL_CACHE, exist_ok=True)
+    np.save(cache_path, probs)
+    return probs
+
+
+def _distillation_trainer(temperature, alpha):
+    import torch
+    import torch.nn.functional as F
+    from transformers import Trainer
+
+    class DistillationTrainer(Trainer):
+        """KL to the teacher's soft labels, plus cross-entropy where a gold label exists."""
+
+        def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+            teacher_probs = inputs.pop("soft_labels")
+            labels = inputs.pop("labels", None)
+            outputs = model(**inputs)
+            logits = outputs.logits
+            loss = F.kl_div(
+                F.log_softmax(logits / temperature, dim=-1), teacher_probs, reduction="batchmean"
+            ) * temperature ** 2
+            if labels is not None and (labels >= 0).any():
+                loss = alpha * loss + (1 - alpha) * F.cross_entropy(logits, labels, ignore_index=-100)
+            return (loss, outputs) if return_outputs else loss
+
+        def prediction_step(self, model, inputs, prediction_loss_only, ignore_keys=None):
+            inputs = dict(inputs)
+            inputs.pop("soft_labels", None)
+            labels = inputs.pop("labels", None)
+            with torch.no_grad():
+                logits = model(**inputs).logits
+            return None, logits, labels
+
+    return DistillationTrainer
+
+
+def distill(teacher=None, student_model="distilbert-base-uncased", output_dir="./farming_student",
+            unlabeled=(), synthetic=500, epochs=5, batch_size=16, temperature=2.0, alpha=0.5):
+    """Train a small student on BART soft labels; saved like train_snips.py output.
+
+    The teacher labels the farming train split and the unlabeled corpus.
+    Train examples keep their gold label for an extra cross-entropy term
+    (weighted ``1 - alpha``); unlabeled ones learn from the teacher only.
+    """
+    from datasets import Dataset
+    from transformers import (
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+        DataCollatorWithPadding,
+        TrainingArguments,
+    )
+
+    from intent_classifier import IntentClassifier
+    from model_loader import default_model_path
+    from train_snips import FarmingIntentClassifier
+
+    teacher = teacher or IntentClassifier(default_model_path())
+    student = FarmingIntentClassifier(model_name=student_model)
+    student.load_farming_data()
+    intents = [student.label_to_intent[i] for i in range(student.num_labels)]
+
+    train = load_split("train")
+    labelled = {e["text"] for e in train}
+    extra = [t for t in unlabeled_texts(unlabeled, synthetic=synthetic) if t not in labelled]
+    texts = [e["text"] for e in train] + extra
+    gold = [student.intent_to_label[e["intent"]] for e in train] + [-100] * len(extra)
+    probs = soft_labels(teacher, texts, intents)
+
+    student.tokenizer = AutoTokenizer.from_pretrained(student_model)
+    student.model = AutoModelForSequenceClassification.from_pretrained(
+        student_model,
+        num_labels=student.num_labels,
+        id2label=student.label_to_intent,
+        label2id=student.intent_to_label,
+    )
+
+    def encode(examples):
+        encoded = student.tokenizer(examples["text"], truncation=True, max_length=student.max_length)
+        encoded["labels"] = examples["label"]
+        encoded["soft_labels"] = examples["soft"]
+        return encoded
+
+    dataset = Dataset.from_dict({"text": texts, "label": gold, "soft": probs.tolist()})
+    dataset = dataset.map(encode, batched=True, remove_columns=["text", "label", "soft"])
+    validation = load_split("validation")
+    val_probs = soft_labels(teacher, [e["text"] for e in validation], intents)
+    eval_dataset = Dataset.from_dict({
+        "text": [e["text"] for e in validation],
+        "label": [student.intent_to_label[e["intent"]] for e in validation],
+        "soft": val_probs.tolist(),
+    }).map(encode, batched=True, remove_columns=["text", "label", "soft"])
+
+    trainer_class = _distillation_trainer(temperature, alpha)
+    trainer = trainer_class(
+        model=student.model,
+        args=TrainingArguments(
+            output_dir=output_dir,
+            num_train_epochs=epochs,
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=batch_size,
+            learning_rate=5e-5,
+            weight_decay=0.01,
+            eval_strategy="epoch",
+            save_strategy="epoch",
+            load_best_model_at_end=True,
+            metric_for_best_model="accuracy",
+            logging_steps=10,
+            remove_unused_columns=False,
+        ),
+        train_dataset=dataset,
+        eval_dataset=eval_dataset,
+        data_collator=DataCollatorWithPadding(student.tokenizer),
+        compute_metrics=student.compute_metrics,
+    )
+    print(f"Distilling into {student_model}: {len(train)} labelled + {len(extra)} unlabeled texts")
+    trainer.train()
+
+    trainer.save_model(output_dir)
+    student.tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "label_mappings.json"), "w") as f:
+        json.dump({"label_to_intent": student.label_to_intent, "intent_to_label": student.intent_to_label},
+                  f, indent=2)
+    print(f"Saved student to {output_dir}")
+    return output_dir
+
+
+def report(student_dir="./farming_student", splits=("validation", "test")):
+    """Student vs teacher accuracy, agreement, latency and memory."""
+    import backends
+
+    student_pred, student = backends.evaluate(lambda: backends.create("fine-tuned", model_dir=student_dir), splits)
+    teacher_pred, teacher = backends.evaluate(lambda: backends.create("zero-shot"), splits)
+    result = {
+        "splits": list(splits),
+        "teacher": teacher,
+        "student": student,
+        "agreement": round(float(np.mean([a == b for a, b in zip(student_pred, teacher_pred)])), 4),
+        "speedup": round(teacher["mean_latency_ms"] / student["mean_latency_ms"], 2),
+        "memory_saved_mb": round(teacher["load_rss_mb"] - student["load_rss_mb"], 1),
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distil zero-shot BART into a small intent classifier")
+    parser.add_argument("command", choices=["train", "report"])
+    parser.add_argument("--student", default="distilbert-base-uncased",
+                        help="student base model, e.g. google/bert_uncased_L-4_H-256_A-4 for a smaller one")
+    parser.add_argument("--output-dir", default="./farming_student")
+    parser.add_argument("--unlabeled", action="append", default=[],
+                        help="JSONL/CSV file of unlabeled queries (repeatable)")
+    parser.add_argument("--synthetic", type=int, default=500, help="synthetic queries added to the corpus")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5, help="weight of the teacher term vs gold labels")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        distill(
+            student_model=args.student, output_dir=args.output_dir, unlabeled=args.unlabeled,
+            synthetic=args.synthetic, epochs=args.epochs, batch_size=args.batch_size,
+            temperature=args.temperature, alpha=args.alpha,
+        )
+    else:
+        report(args.output_dir)
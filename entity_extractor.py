@@ -1,4 +1,7 @@
-from rapidfuzz import process, fuzz
+import re
+from collections import deque
+
+from rapidfuzz.distance import OSA
 
 
 # Simple crop list (extendable)
@@ -59,26 +62,254 @@ _CROPS = [
     "sisal",
 ]
 
+# Regional and alternative names, mapped to the canonical crop (extendable)
+_SYNONYMS = {
+    "maize": ["corn"],
+    "rice": ["paddy"],
+    "soybean": ["soya", "soy", "soya bean"],
+    "sugarcane": ["sugar cane"],
+    "sorghum": ["jowar"],
+    "chickpeas": ["chana", "bengal gram"],
+    "groundnut": ["peanut"],
+    "eggplant": ["brinjal", "aubergine"],
+    "okra": ["bhindi", "lady finger", "ladyfinger"],
+    "bitter gourd": ["karela", "bitter melon"],
+    "pepper": ["capsicum", "bell pepper", "chilli", "chili"],
+    "mustard": ["rapeseed"],
+}
+
+# Common words within one typo of a crop name ("apply" -> "apple",
+# "barely" -> "barley"); never corrected to a crop.
+_NOT_CROPS = {
+    "apply", "applies", "ample", "range", "parrot", "union", "unions",
+    "barely", "rubbed", "robber", "china", "chill", "chilly", "child",
+    "grade", "grades", "grace", "means", "beams", "bears", "beads",
+    "times", "lines", "likes", "prices", "custard", "toffee", "cashed",
+    "cheat", "cheats", "coins", "lives", "limbs", "beats", "helps", "temps",
+    "graph", "graphs", "grave", "cores", "races", "rides", "ranges", "parrots",
+    "tango",
+}
+
+_WORD = re.compile(r"\w+")
+
+
+def _variants(name):
+    """Surface forms for a crop name: itself plus singular/plural forms."""
+    forms = {name}
+    head, _, last = name.rpartition(" ")
+    prefix = f"{head} " if head else ""
+    if last.endswith("oes"):
+        forms.add(prefix + last[:-2])
+    elif last.endswith("s") and not last.endswith("ss"):
+        forms.add(prefix + last[:-1])
+    elif last.endswith("o"):
+        forms.update({prefix + last + "es", prefix + last + "s"})
+    elif last.endswith(("sh", "ch", "x")):
+        forms.add(prefix + last + "es")
+    elif last.endswith("y") and last[-2:-1] not in "aeiou":
+        forms.add(prefix + last[:-1] + "ies")
+    else:
+        forms.add(prefix + last + "s")
+    return forms
+
+
+class _AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every pattern."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((len(pattern), value))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                # Children of the root always fail back to the root.
+                self._fail[nxt] = self._goto[fail].get(ch, 0) if node else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter(self, text):
+        """Yield (start, end, value) for every pattern occurrence in ``text``."""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._out[node]:
+                yield i + 1 - length, i + 1, value
+
+
+class _DeletionIndex:
+    """SymSpell-style index: maps deletion variants back to dictionary terms.
+
+    A misspelling and its intended term share at least one deletion variant
+    when they are within ``max_distance`` edits, so candidates are found by
+    hashing rather than by comparing against every term.
+    """
+
+    def __init__(self, terms, max_distance=2):
+        self.max_distance = max_distance
+        self._index = {}
+        for term, value in terms.items():
+            for variant in self._deletes(term, self._allowed(term)):
+                self._index.setdefault(variant, set()).add((term, value))
+
+    @staticmethod
+    def _allowed(term):
+        # Short words are too close to ordinary English to correct safely.
+        if len(term) < 5:
+            return 0
+        return 1 if len(term) < 9 else 2
+
+    @staticmethod
+    def _deletes(word, distance):
+        found = {word}
+        frontier = {word}
+        for _ in range(distance):
+            frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+            found |= frontier
+        return found
+
+    def lookup(self, word):
+        """Return (term, value, distance) for the closest indexed term, or None."""
+        if not self._allowed(word):
+            return None
+        # Terms that allow two edits are 9+ chars, so they are out of reach
+        # of words shorter than 7.
+        distance = self.max_distance if len(word) >= 7 else 1
+        best = None
+        for variant in self._deletes(word, distance):
+            for term, value in self._index.get(variant, ()):
+                limit = self._allowed(term)
+                distance = OSA.distance(word, term, score_cutoff=limit)
+                if distance <= limit and (best is None or distance < best[2]):
+                    best = (term, value, distance)
+        return best
+
+
+def _build_matchers(crops, synonyms):
+    surface = {}
+    for crop in crops:
+        for name in [crop] + synonyms.get(crop, []):
+            for form in _variants(name):
+                surface.setdefault(form, crop)
+    return _AhoCorasick(surface), _DeletionIndex(surface)
+
+
+_EXACT, _FUZZY = _build_matchers(_CROPS, _SYNONYMS)
+
+
+def _lower(text):
+    """``text`` lower-cased one character at a time, keeping its length.
+
+    ``str.lower`` can lengthen a string ("İ" becomes two characters), which
+    would shift every offset after it; such characters are left as they are.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+
+
+def _is_boundary(text, start, end):
+    return (start == 0 or not text[start - 1].isalnum()) and \
+        (end == len(text) or not text[end].isalnum())
+
+
+def _exact_mentions(text, text_lower):
+    """Exact names, synonyms and plurals as leftmost-longest whole-word hits."""
+    hits = sorted(
+        (m for m in _EXACT.iter(text_lower) if _is_boundary(text_lower, m[0], m[1])),
+        key=lambda m: (m[0], -(m[1] - m[0])),
+    )
+    mentions = []
+    taken_until = 0
+    for start, end, crop in hits:
+        if start >= taken_until:
+            mentions.append({"crop": crop, "text": text[start:end], "start": start, "end": end, "score": 100.0})
+            taken_until = end
+    return mentions
+
+
+def _fuzzy_mentions(text, text_lower, covered, threshold):
+    """Corrected misspellings among words and word pairs outside ``covered``."""
+    words = [w for w in _WORD.finditer(text_lower)
+             if w.group() not in _NOT_CROPS and not any(s <= w.start() < e for s, e in covered)]
+    candidates = [(w.start(), w.end(), w.group()) for w in words]
+    candidates += [
+        (a.start(), b.end(), f"{a.group()} {b.group()}")
+        for a, b in zip(words, words[1:])
+        if text_lower[a.end():b.start()].isspace()
+    ]
+    found = []
+    for start, end, word in candidates:
+        match = _FUZZY.lookup(word)
+        if match:
+            term, crop, distance = match
+            score = 100.0 * (1 - distance / max(len(term), len(word)))
+            if score >= threshold:
+                found.append({"crop": crop, "text": text[start:end], "start": start, "end": end, "score": score})
+
+    mentions = []
+    covered = list(covered)
+    for mention in sorted(found, key=lambda m: -m["score"]):
+        if all(mention["end"] <= s or mention["start"] >= e for s, e in covered):
+            mentions.append(mention)
+            covered.append((mention["start"], mention["end"]))
+    return mentions
+
+
+def extract_crops(text, threshold=70):
+    """Return every crop mentioned in ``text``, in order of appearance.
+
+    Each mention is a dict with ``crop`` (canonical name), ``text`` (as
+    written), ``start``/``end`` character offsets and ``score`` (100 for an
+    exact name, synonym or plural; lower for corrected misspellings).
+    """
+    if not text or not text.strip():
+        return []
+    text_lower = _lower(text)
+    mentions = _exact_mentions(text, text_lower)
+    covered = [(m["start"], m["end"]) for m in mentions]
+    mentions += _fuzzy_mentions(text, text_lower, covered, threshold)
+    return sorted(mentions, key=lambda m: m["start"])
+
 
 def extract_crop(text, threshold=70):
     """Return best crop match from text or None.
 
-    Uses fuzzy matching to find crop names mentioned in farmer text.
+    Uses the first exact mention (name, synonym or plural) and only falls
+    back to typo correction when there is none.
     """
     if not text or not text.strip():
         return None
-    text_lower = text.lower()
-    # try direct containment first
-    for c in _CROPS:
-        if c in text_lower:
-            return c
-
-    # fallback: fuzzy match using rapidfuzz
-    best = process.extractOne(text_lower, _CROPS, scorer=fuzz.partial_ratio)
-    if best and best[1] >= threshold:
-        return best[0]
+    text_lower = _lower(text)
+    exact = _exact_mentions(text, text_lower)
+    if exact:
+        return exact[0]["crop"]
+    fuzzy = _fuzzy_mentions(text, text_lower, [], threshold)
+    if fuzzy:
+        return max(fuzzy, key=lambda m: m["score"])["crop"]
     return None
 
 
 if __name__ == "__main__":
     print(extract_crop("Should I apply urea to my maize?"))
+    print(extract_crops("Aphids on my chickpeas and tomatoes, also the bitter gourd and whaet"))
@@ -0,0 +1,17 @@
+import json
+import os
+
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "farming_dataset")
+SPLITS = ("train", "validation", "test")
+
+
+def load_split(split, dataset_dir=DATASET_DIR):
+    """Load one farming_dataset split as a list of {"text", "intent"} dicts."""
+    with open(os.path.join(dataset_dir, f"{split}.json"), "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    for split in SPLITS:
+        print(split, len(load_split(split)))
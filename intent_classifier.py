@@ -1,17 +1,50 @@
-from transformers import pipeline
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from backends import normalize_result
+from batching import length_buckets
+from farming_data import load_split
 
 
 class IntentClassifier:
     """Intent classifier using zero-shot BART (pre-trained, no fine-tuning)."""
 
-    def __init__(self):
-        """Initialize zero-shot classifier."""
-        print("Loading intent classifier (zero-shot BART)...")
+    def __init__(self, model=None):
+        """Initialize zero-shot classifier.
+
+        ``model`` is a hub id or a local snapshot directory (see
+        model_loader.py snapshot); safetensors weights in a local snapshot
+        are memory-mapped rather than read into fresh buffers.
+        """
+        # Imported here so that importing this module (e.g. for the keyword
+        # fallback) doesn't pay for torch/transformers start-up.
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+        model = model or os.environ.get("INTENT_MODEL_PATH", "facebook/bart-large-mnli")
+        print(f"Loading intent classifier (zero-shot BART from {model})...")
         
-        self.classifier = pipeline(
-            "zero-shot-classification",
-            model="facebook/bart-large-mnli"
-        )
+        if os.path.isdir(model):
+            self.classifier = pipeline(
+                "zero-shot-classification",
+                model=AutoModelForSequenceClassification.from_pretrained(
+                    model, use_safetensors=True, low_cpu_mem_usage=True
+                ),
+                tokenizer=AutoTokenizer.from_pretrained(model)
+            )
+        else:
+            self.classifier = pipeline(
+                "zero-shot-classification",
+                model=model
+            )
         
         # Main farming intents
         self.intents = [
@@ -26,32 +59,527 @@ class IntentClassifier:
         
         print("Classifier loaded successfully!")
 
+    def _format_result(self, result):
+        """Convert a raw pipeline result into the classifier result dict."""
+        return {
+            "intent": result["labels"][0],
+            "score": float(result["scores"][0]),
+            "all": [
+                {"intent": label, "score": float(score)}
+                for label, score in zip(result["labels"], result["scores"])
+            ]
+        }
+
+    def _error_result(self, error):
+        return {
+            "intent": "unknown",
+            "score": 0.0,
+            "error": str(error),
+            "all": []
+        }
+
     def predict(self, text):
         """Predict intent using zero-shot classification."""
         try:
             result = self.classifier(text, self.intents, multi_class=False)
-            
-            top_intent = result["labels"][0]
-            confidence = float(result["scores"][0])
-            
-            return {
-                "intent": top_intent,
-                "score": confidence,
-                "all": [
-                    {"intent": label, "score": float(score)}
-                    for label, score in zip(result["labels"], result["scores"])
-                ]
-            }
+            return self._format_result(result)
         except Exception as e:
             print(f"Error in predict: {e}")
-            return {
-                "intent": "unknown",
-                "score": 0.0,
-                "error": str(e),
-                "all": []
-            }
+            metrics.inc("classifier_errors_total", "Exceptions swallowed by IntentClassifier")
+            return self._error_result(e)
+
+    def predict_batch(self, texts, batch_size=16):
+        """Predict intents for many texts, batching similar-length texts.
+
+        Every text is paired with every intent, so each model batch holds
+        ``len(chunk) * len(self.intents)`` premise/hypothesis pairs padded to
+        the longest pair in that chunk. Results come back in input order.
+        """
+        import torch
+
+        texts = list(texts)
+        results = [None] * len(texts)
+        for indices in length_buckets(texts, batch_size):
+            chunk = [texts[i] for i in indices]
+            try:
+                with torch.inference_mode():
+                    outputs = self.classifier(
+                        chunk,
+                        self.intents,
+                        multi_class=False,
+                        batch_size=len(chunk) * len(self.intents)
+                    )
+                if isinstance(outputs, dict):
+                    outputs = [outputs]
+                formatted = [self._format_result(output) for output in outputs]
+            except Exception as e:
+                print(f"Error in predict_batch: {e}")
+                metrics.inc("classifier_errors_total", "Exceptions swallowed by IntentClassifier")
+                formatted = [self._error_result(e) for _ in chunk]
+            for i, result in zip(indices, formatted):
+                results[i] = result
+        return results
+
+
+
+class FineTunedIntentClassifier:
+    """Drop-in backend for a model saved by train_snips.py or distill.py.
+
+    Wraps ``FarmingIntentClassifier`` and returns ``all`` in the same
+    ``[{"intent", "score"}]`` form as the other backends. ``variant`` and
+    ``max_length`` are the inference settings autotune.py sweeps.
+    """
+
+    def __init__(self, model_dir=None, variant="inference_mode", max_length=128):
+        from train_snips import FarmingIntentClassifier
+
+        model_dir = model_dir or os.environ.get("INTENT_MODEL_DIR", "./farming_model")
+        self.model = FarmingIntentClassifier(max_length=max_length)
+        self.model.load_model(model_dir)
+        self.model.optimize(variant)
+        self.intents = [self.model.label_to_intent[i] for i in sorted(self.model.label_to_intent)]
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        return [normalize_result(result) for result in self.model.predict_batch(texts)]
+
+
+# Natural-language descriptions used by the embedding backend. Covers every
+# intent responder.build_response knows how to answer.
+INTENT_DESCRIPTIONS = {
+    "ask_crop_info": "general information about growing a crop, its duration, climate and yield",
+    "ask_fertilizer": "which fertilizer, manure or nutrients (NPK, urea, compost) to apply and how much",
+    "ask_pest": "controlling insect pests such as aphids, borers, worms and whiteflies",
+    "ask_irrigation": "watering the crop, irrigation schedule and how much water is needed",
+    "ask_planting": "when and how to sow or plant, seed rate and spacing",
+    "ask_harvesting": "when and how to harvest the crop and signs of maturity",
+    "ask_disease": "plant diseases such as blight, rust, mildew, rot and how to treat them",
+    "ask_soil": "soil health, soil testing, pH, organic matter and soil preparation",
+    "ask_weather": "weather forecast, rain, heatwave or frost and its effect on crops",
+    "ask_seed": "buying good quality certified seeds, seed varieties and seed storage",
+    "ask_market": "market prices, mandi rates and selling the produce",
+    "ask_subsidy": "government schemes, subsidies, loans and crop insurance for farmers",
+    "ask_equipment": "farm machinery, tractors, tools and equipment",
+    "greeting": "hello, hi, greeting the assistant",
+    "thanks": "thank you, thanks for the help",
+}
+
+_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "label_embeddings")
+
+
+class EmbeddingIntentClassifier:
+    """Bi-encoder intent classifier with precomputed label embeddings.
+
+    Each intent is embedded once from its description plus the matching
+    ``farming_dataset`` training utterances; the vectors are cached on disk.
+    A query then costs one encoder pass and a cosine-similarity matrix
+    product, independent of how many intents there are.
+    """
+
+    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2",
+                 descriptions=None, examples=None, temperature=0.05, cache_dir=_CACHE_DIR):
+        from transformers import AutoModel, AutoTokenizer
+
+        print(f"Loading intent classifier (embeddings, {model_name})...")
+        self.model_name = model_name
+        self.temperature = temperature
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+
+        descriptions = descriptions or INTENT_DESCRIPTIONS
+        examples = examples if examples is not None else load_split("train")
+        self.intents = list(descriptions)
+        label_texts = {
+            intent: [description] + [ex["text"] for ex in examples if ex["intent"] == intent]
+            for intent, description in descriptions.items()
+        }
+        self.label_embeddings = self._load_label_embeddings(label_texts, cache_dir)
+        print("Classifier loaded successfully!")
+
+    def _load_label_embeddings(self, label_texts, cache_dir):
+        key = hashlib.sha1(
+            json.dumps([self.model_name, label_texts], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        path = os.path.join(cache_dir, f"{key}.npy") if cache_dir else None
+        if path and os.path.exists(path):
+            return np.load(path)
+
+        vectors = []
+        for intent in self.intents:
+            centroid = self.encode(label_texts[intent]).mean(axis=0)
+            vectors.append(centroid / np.linalg.norm(centroid))
+        matrix = np.stack(vectors).astype(np.float32)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(path, matrix)
+        return matrix
+
+    def encode(self, texts, batch_size=64):
+        """Return L2-normalized mean-pooled embeddings for ``texts``."""
+        import torch
+
+        chunks = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                return_tensors="pt",
+                truncation=True,
+                padding=True,
+                max_length=128
+            )
+            with torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            chunks.append(torch.nn.functional.normalize(pooled, dim=-1).numpy())
+        return np.concatenate(chunks)
+
+    def _format_scores(self, similarities):
+        probs = _softmax(similarities / self.temperature)
+        order = np.argsort(-probs)
+        return {
+            "intent": self.intents[order[0]],
+            "score": float(probs[order[0]]),
+            "all": [
+                {"intent": self.intents[i], "score": float(probs[i])}
+                for i in order
+            ]
+        }
+
+    def predict(self, text):
+        """Predict intent by cosine similarity to the label embeddings."""
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        similarities = self.encode(texts) @ self.label_embeddings.T
+        return [self._format_scores(row) for row in similarities]
+
+
+class KeywordIntentClassifier:
+    """Cheap first-stage classifier: TF-IDF features + logistic regression.
+
+    Trained in well under a second on ``farming_dataset/train.json``. Scoring
+    bypasses sklearn's per-call overhead and uses the fitted vocabulary and
+    weights directly, so a query costs tens of microseconds. Probabilities are
+    temperature-scaled on cross-validated logits so ``score`` can be compared
+    against a confidence threshold.
+    """
+
+    def __init__(self, examples=None, C=10.0):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.model_selection import cross_val_predict
+        from scipy.sparse import hstack
+
+        examples = examples if examples is not None else load_split("train")
+        texts = [example["text"] for example in examples]
+        labels = [example["intent"] for example in examples]
+
+        # Word n-grams carry the keywords; character n-grams absorb
+        # plurals and misspellings ("fertiliser", "tomatoes").
+        vectorizers = [
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True),
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 5), sublinear_tf=True),
+        ]
+        blocks = [vectorizer.fit_transform(texts) for vectorizer in vectorizers]
+        features = hstack(blocks).tocsr()
+        model = LogisticRegression(C=C, max_iter=1000)
+        model.fit(features, labels)
+
+        self.intents = [str(intent) for intent in model.classes_]
+        self._coef = model.coef_.T.copy()
+        self._intercept = model.intercept_.copy()
+        self._blocks = []
+        offset = 0
+        for vectorizer in vectorizers:
+            self._blocks.append((
+                vectorizer.build_analyzer(),
+                {term: offset + i for term, i in vectorizer.vocabulary_.items()},
+                vectorizer.idf_,
+                offset,
+            ))
+            offset += len(vectorizer.vocabulary_)
+
+        folds = min(3, min(labels.count(intent) for intent in self.intents))
+        cv_logits = cross_val_predict(
+            LogisticRegression(C=C, max_iter=1000), features, labels,
+            cv=folds, method="decision_function"
+        )
+        targets = np.array([self.intents.index(label) for label in labels])
+        self.temperature = _fit_temperature(cv_logits, targets)
+
+    def _logits(self, text):
+        """Sparse TF-IDF transform and linear layer, mirroring sklearn's math."""
+        logits = self._intercept.copy()
+        for analyzer, vocabulary, idf, offset in self._blocks:
+            counts = {}
+            for term in analyzer(text):
+                index = vocabulary.get(term)
+                if index is not None:
+                    counts[index] = counts.get(index, 0) + 1
+            if not counts:
+                continue
+            indices = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+            weights = np.fromiter(
+                (1.0 + math.log(c) for c in counts.values()), dtype=float, count=len(counts)
+            ) * idf[indices - offset]
+            weights /= np.sqrt(weights @ weights)
+            logits += weights @ self._coef[indices]
+        return logits
+
+    def predict(self, text):
+        """Predict intent with a calibrated confidence score."""
+        probs = _softmax(self._logits(text or "") / self.temperature)
+        order = np.argsort(-probs)
+        return {
+            "intent": self.intents[order[0]],
+            "score": float(probs[order[0]]),
+            "all": [
+                {"intent": self.intents[i], "score": float(probs[i])}
+                for i in order
+            ]
+        }
+
+    def predict_batch(self, texts):
+        return [self.predict(text) for text in texts]
+
+
+def _softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _fit_temperature(logits, targets):
+    """Pick the softmax temperature minimizing NLL on held-out logits."""
+    best_t, best_nll = 1.0, float("inf")
+    for t in np.linspace(0.1, 3.0, 59):
+        probs = _softmax(logits / t)
+        nll = -np.mean(np.log(probs[np.arange(len(targets)), targets] + 1e-12))
+        if nll < best_nll:
+            best_t, best_nll = float(t), nll
+    return best_t
+
+
+class RuleIntentClassifier:
+    """Keyword-rule intent guess with no model and no start-up cost.
+
+    Counts keyword hits per intent (``ask_crop_info`` when nothing
+    matches). Keywords are regexes matched at the start of a word, so
+    stems like ``fertili`` cover "fertilizer"/"fertiliser" while short
+    words such as "rot" or "water" don't fire on "rotation", "carrot" or
+    "watermelon" (``crop_conflicts`` checks the crop names). Much less
+    accurate than the models; it answers when the model can't within the
+    latency budget.
+    """
+
+    RULES = {
+        "ask_fertilizer": ("fertili", "manure", "urea", "npk", "nitrogen", "phosph", "potash", "potassium",
+                           "compost", "nutrient", "magnesium", "zinc", "boron", "calcium", r"dap\b"),
+        "ask_pest": ("pest", "insect", "aphid", "worm", "borer", "thrip", "mite", "weevil", "beetle",
+                     "locust", "whitefl", "caterpillar", r"bugs?\b", "hopper", "nematode"),
+        "ask_disease": ("disease", "blight", r"rust\b", r"rot(?:s|ten|ting)?\b", "wilt", "mildew", "fung",
+                        "virus", r"spots?\b", "yellow", "infect", "resistan", "canker", "mosaic"),
+        "ask_irrigation": ("irrigat", r"water(?:s|ed|ing)?\b", "drip", "sprinkler", "moisture", "drought", r"rain(?:s|fall|y)?\b"),
+        "ask_harvesting": ("harvest", "yield", "storage", r"stor(?:e|ed|ing)\b", "ripe", r"pick(?:s|ed|ing)?\b",
+                           "preserv", "post-harvest"),
+        "ask_planting": ("plant", r"sow", "seed", "spacing", "germinat", "nursery"),
+        "ask_crop_info": ("about", "info", "detail", "guide", "grow", "cultivat", "farming", "variet"),
+    }
+
+    def __init__(self, rules=None):
+        self.rules = rules or self.RULES
+        self.intents = list(self.rules)
+        self._patterns = [re.compile(r"\b(?:" + "|".join(stems) + ")") for stems in self.rules.values()]
+
+    def predict(self, text):
+        text = (text or "").lower()
+        hits = np.array([len(pattern.findall(text)) for pattern in self._patterns], dtype=float)
+        if not hits.any():
+            hits[self.intents.index("ask_crop_info")] = 1.0
+        # Ties go to the intent listed first, so specific intents beat crop info.
+        order = np.argsort(-hits, kind="stable")
+        probs = (hits + 0.1) / (hits + 0.1).sum()
+        return {
+            "intent": self.intents[order[0]],
+            "score": float(probs[order[0]]),
+            "all": [{"intent": self.intents[i], "score": float(probs[i])} for i in order],
+        }
+
+    def predict_batch(self, texts):
+        return [self.predict(text) for text in texts]
+
+    def crop_conflicts(self):
+        """(crop name, intent, keyword) for every crop name or synonym a rule fires on."""
+        from entity_extractor import _CROPS, _SYNONYMS
+
+        names = list(_CROPS) + [name for synonyms in _SYNONYMS.values() for name in synonyms]
+        return [(name, intent, match.group())
+                for name in names
+                for intent, pattern in zip(self.intents, self._patterns)
+                for match in [pattern.search(name.lower())] if match]
+
+
+class FakeIntentClassifier:
+    """Deterministic stand-in for the transformer in offline benchmarks.
+
+    The intent and scores are a hash of the text, so repeated runs give
+    identical answers; each batch sleeps ``latency_ms`` plus
+    ``per_query_ms`` per query to mimic model cost without loading one.
+    """
+
+    def __init__(self, latency_ms=20.0, per_query_ms=1.0, intents=None):
+        self.latency_ms = latency_ms
+        self.per_query_ms = per_query_ms
+        self.intents = intents or sorted({example["intent"] for example in load_split("train")})
+
+    def _scores(self, text):
+        digest = hashlib.sha1((text or "").strip().lower().encode("utf-8")).digest()
+        logits = np.resize(np.frombuffer(digest, dtype=np.uint8), len(self.intents)) / 32.0
+        return _softmax(logits)
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        texts = list(texts)
+        time.sleep((self.latency_ms + self.per_query_ms * len(texts)) / 1000.0)
+        results = []
+        for text in texts:
+            probs = self._scores(text)
+            order = np.argsort(-probs, kind="stable")
+            results.append({
+                "intent": self.intents[order[0]],
+                "score": float(probs[order[0]]),
+                "all": [{"intent": self.intents[i], "score": float(probs[i])} for i in order],
+            })
+        return results
+
+
+class CascadeClassifier:
+    """Two-stage classifier: cheap keyword model first, transformer on doubt.
+
+    Queries whose first-stage confidence reaches ``threshold`` are answered
+    immediately; the rest escalate to ``second_stage`` (zero-shot BART by
+    default, created lazily on the first escalation; the ``cascade``
+    backend builds it up front). Results carry a ``"stage"`` key naming the
+    model that answered.
+    """
+
+    def __init__(self, first_stage=None, second_stage=None, threshold=0.7):
+        self.first_stage = first_stage or KeywordIntentClassifier()
+        self._second_stage = second_stage
+        self._second_stage_lock = threading.Lock()
+        self.threshold = threshold
+
+    @property
+    def second_stage(self):
+        if self._second_stage is None:
+            with self._second_stage_lock:
+                if self._second_stage is None:
+                    from model_loader import default_model_path
+
+                    self._second_stage = IntentClassifier(default_model_path())
+        return self._second_stage
+
+    def _escalate(self, texts):
+        if hasattr(self.second_stage, "predict_batch"):
+            results = self.second_stage.predict_batch(texts)
+        else:
+            results = [self.second_stage.predict(text) for text in texts]
+        return [normalize_result(result) for result in results]
+
+    def _merge(self, first, second):
+        if second.get("intent", "unknown") == "unknown":
+            return dict(first, stage="keyword")
+        return dict(second, stage="transformer", first_stage=first)
+
+    def predict(self, text):
+        """Predict intent, escalating to the transformer when unsure."""
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        texts = list(texts)
+        results = self.first_stage.predict_batch(texts)
+        for result in results:
+            result["stage"] = "keyword"
+        escalate = [i for i, result in enumerate(results) if result["score"] < self.threshold]
+        if escalate:
+            second = self._escalate([texts[i] for i in escalate])
+            for i, result in zip(escalate, second):
+                results[i] = self._merge(results[i], result)
+        return results
+
+
+def cascade_report(cascade, splits=("validation", "test")):
+    """Print accuracy, escalation rate and end-to-end latency per split."""
+    report = {}
+    for split in splits:
+        examples = load_split(split)
+        latencies = []
+        correct = first_stage_correct = escalated = 0
+        for example in examples:
+            start = time.perf_counter()
+            result = cascade.predict(example["text"])
+            latencies.append(1000 * (time.perf_counter() - start))
+            correct += result["intent"] == example["intent"]
+            first = result.get("first_stage", result)
+            first_stage_correct += first["intent"] == example["intent"]
+            # Counted from the decision, not the stage label: an escalation
+            # whose second stage answered "unknown" comes back as "keyword".
+            escalated += first["score"] < cascade.threshold
+        latencies.sort()
+        n = len(examples)
+        report[split] = {
+            "examples": n,
+            "accuracy": correct / n,
+            "first_stage_accuracy": first_stage_correct / n,
+            "escalation_rate": escalated / n,
+            "mean_latency_ms": sum(latencies) / n,
+            "p95_latency_ms": latencies[int(0.95 * (n - 1))],
+        }
+        r = report[split]
+        print(
+            f"{split}: accuracy={r['accuracy']:.3f} "
+            f"(keyword only {r['first_stage_accuracy']:.3f}), "
+            f"escalation={r['escalation_rate']:.1%}, "
+            f"latency mean={r['mean_latency_ms']:.2f}ms p95={r['p95_latency_ms']:.2f}ms"
+        )
+    return report
 
 
 if __name__ == "__main__":
-    c = IntentClassifier()
-    print(c.predict("Which fertilizer should I use for maize?"))
+    parser = argparse.ArgumentParser(description="Farming intent classifiers")
+    parser.add_argument("--cascade-report", action="store_true",
+                        help="evaluate the keyword -> transformer cascade")
+    parser.add_argument("--check-rules", action="store_true",
+                        help="fail if a keyword rule fires on a crop name")
+    parser.add_argument("--embedding", action="store_true",
+                        help="use the embedding backend instead of zero-shot BART")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--second-stage", choices=["zero-shot", "fine-tuned"], default="zero-shot")
+    parser.add_argument("--model-dir", default="./farming_model")
+    args = parser.parse_args()
+
+    if args.cascade_report:
+        second_stage = None
+        if args.second_stage == "fine-tuned":
+            second_stage = FineTunedIntentClassifier(args.model_dir)
+        cascade_report(CascadeClassifier(second_stage=second_stage, threshold=args.threshold))
+    elif args.check_rules:
+        conflicts = RuleIntentClassifier().crop_conflicts()
+        for name, intent, keyword in conflicts:
+            print(f"{name!r} matches {intent} keyword {keyword!r}")
+        print(f"{len(conflicts)} crop names match a keyword rule")
+        raise SystemExit(1 if conflicts else 0)
+    elif args.embedding:
+        c = EmbeddingIntentClassifier()
+        print(c.predict("Which fertilizer should I use for maize?"))
+    else:
+        c = IntentClassifier()
+        print(c.predict("Which fertilizer should I use for maize?"))
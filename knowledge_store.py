@@ -0,0 +1,224 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "knowledge.db")
+
+_SCHEMA = """
+CREATE TABLE advice (
+    intent TEXT NOT NULL,
+    crop TEXT NOT NULL DEFAULT '',
+    region TEXT NOT NULL DEFAULT '',
+    season TEXT NOT NULL DEFAULT '',
+    advice TEXT NOT NULL,
+    UNIQUE (intent, crop, region, season)
+);
+"""
+
+
+def _rows_from_dict(knowledge):
+    """Flatten the responder's {intent: {crop: advice}} dict into store rows."""
+    for intent, by_crop in knowledge.items():
+        for crop, advice in by_crop.items():
+            yield {"intent": intent, "crop": crop, "advice": advice}
+
+
+def _rows_from_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_store(path=DEFAULT_PATH, knowledge=None, sources=()):
+    """Write a SQLite knowledge store from a dict and/or JSONL files.
+
+    JSONL rows look like ``{"intent", "crop", "region", "season", "advice"}``
+    (all but intent and advice optional). The file is written next to
+    ``path`` and moved into place, so a running app never reads a partial
+    store.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(_SCHEMA)
+        rows = list(_rows_from_dict(knowledge or {}))
+        for source in sources:
+            rows.extend(_rows_from_jsonl(source))
+        conn.executemany(
+            "INSERT OR REPLACE INTO advice (intent, crop, region, season, advice) VALUES (?, ?, ?, ?, ?)",
+            (
+                (row["intent"], row.get("crop") or "", row.get("region") or "",
+                 row.get("season") or "", row["advice"])
+                for row in rows
+            ),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    print(f"Wrote {len(rows)} entries to {path}")
+    return path
+
+
+class _Snapshot:
+    """Immutable, fully indexed view of one version of the store."""
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.index = {}
+        self.fallback = {}
+        self.any_variant = {}
+        self.crop_intents = set()
+        self.regions, self.seasons = set(), set()
+        for intent, crop, region, season, advice in rows:
+            intent, crop = sys.intern(intent), sys.intern(crop)
+            self.index[(intent, crop, sys.intern(region), sys.intern(season))] = advice
+            # The first regional/seasonal row answers when a crop has no general one.
+            self.any_variant.setdefault((intent, crop), advice)
+            if region:
+                self.regions.add(region)
+            if season:
+                self.seasons.add(season)
+            if crop and crop != "default":
+                self.crop_intents.add(intent)
+                # The first crop listed for an intent answers for unknown crops.
+                self.fallback.setdefault(intent, advice)
+        self.entries = len(self.index)
+        self.bytes = sys.getsizeof(self.index) + sum(
+            sys.getsizeof(key) + sys.getsizeof(value) for key, value in self.index.items()
+        )
+
+
+class KnowledgeStore:
+    """Advice lookup keyed by (intent, crop, region, season).
+
+    Loads either a SQLite file built by ``build_store`` or an in-memory dict
+    in the responder's ``{intent: {crop: advice}}`` shape. Every lookup is a
+    dict hit; the fallback for unknown crops is resolved once at load time.
+    When backed by a file, the store re-checks its mtime at most every
+    ``check_interval`` seconds and swaps in the new snapshot atomically.
+    """
+
+    def __init__(self, path=None, knowledge=None, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._knowledge = knowledge or {}
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked_at = 0.0
+        self._snapshot = self._load()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            self._stamp = self._file_stamp()
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(
+                    "SELECT intent, crop, region, season, advice FROM advice ORDER BY rowid"
+                ).fetchall()
+            finally:
+                conn.close()
+        else:
+            rows = [(r["intent"], r["crop"], "", "", r["advice"]) for r in _rows_from_dict(self._knowledge)]
+        version = hashlib.sha1(json.dumps(rows).encode("utf-8")).hexdigest()
+        return _Snapshot(rows, version)
+
+    def maybe_reload(self):
+        """Reload if the backing file changed; cheap enough to call per request."""
+        if not self.path:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            if self._file_stamp() == self._stamp:
+                return False
+            try:
+                self._snapshot = self._load()
+            except sqlite3.Error as e:
+                print(f"Knowledge store reload failed, keeping previous version: {e}")
+                return False
+        print(f"Reloaded knowledge store ({self._snapshot.entries} entries)")
+        return True
+
+    @property
+    def version(self):
+        self.maybe_reload()
+        return self._snapshot.version
+
+    def lookup(self, intent, crop, region=None, season=None):
+        """Most specific advice for the crop, or None.
+
+        A crop whose only rows are for some region or season still gets
+        one of those rather than no crop advice at all.
+        """
+        index = self._snapshot.index
+        region, season = region or "", season or ""
+        for key in ((intent, crop, region, season), (intent, crop, region, ""),
+                    (intent, crop, "", season), (intent, crop, "", "")):
+            advice = index.get(key)
+            if advice is not None:
+                return advice
+        return self._snapshot.any_variant.get((intent, crop))
+
+    def variants(self):
+        """Regions and seasons that have their own advice rows, sorted."""
+        snapshot = self._snapshot
+        return {"regions": sorted(snapshot.regions), "seasons": sorted(snapshot.seasons)}
+
+    def default(self, intent):
+        """Crop-independent advice for an intent, or None."""
+        return self._snapshot.index.get((intent, "default", "", ""))
+
+    def fallback(self, intent):
+        """Advice served for crops the store has no entry for, or None."""
+        return self._snapshot.fallback.get(intent)
+
+    def is_crop_specific(self, intent):
+        return intent in self._snapshot.crop_intents
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "path": self.path,
+            "version": snapshot.version,
+            "entries": snapshot.entries,
+            "bytes": snapshot.bytes,
+            "bytes_per_entry": snapshot.bytes / snapshot.entries if snapshot.entries else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the advice knowledge store")
+    parser.add_argument("command", choices=["build", "stats"])
+    parser.add_argument("--path", default=os.environ.get("KNOWLEDGE_DB", DEFAULT_PATH))
+    parser.add_argument("--source", action="append", default=[],
+                        help="extra JSONL file of advice rows (repeatable)")
+    parser.add_argument("--no-builtin", action="store_true",
+                        help="don't include the advice built into responder.py")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from responder import _CROP_SPECIFIC_INFO
+        build_store(args.path, None if args.no_builtin else _CROP_SPECIFIC_INFO, args.source)
+    else:
+        print(json.dumps(KnowledgeStore(args.path).stats(), indent=2))
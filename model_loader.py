@@ -0,0 +1,160 @@
+import argparse
+import os
+import threading
+import time
+import traceback
+
+import metrics
+from farming_data import load_split
+from sysinfo import process_start_time
+
+
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "bart-large-mnli")
+
+
+def snapshot_model(model_id="facebook/bart-large-mnli", output_dir=DEFAULT_SNAPSHOT_DIR):
+    """Save a local safetensors copy of a hub model for fast, mmap-able loads."""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    print(f"Saving {model_id} to {output_dir}...")
+    AutoTokenizer.from_pretrained(model_id).save_pretrained(output_dir)
+    AutoModelForSequenceClassification.from_pretrained(model_id).save_pretrained(
+        output_dir, safe_serialization=True
+    )
+    return output_dir
+
+
+def default_model_path():
+    """Local snapshot if one exists, else INTENT_MODEL_PATH or the hub id."""
+    if os.environ.get("INTENT_MODEL_PATH"):
+        return os.environ["INTENT_MODEL_PATH"]
+    if os.path.isdir(DEFAULT_SNAPSHOT_DIR):
+        return DEFAULT_SNAPSHOT_DIR
+    return "facebook/bart-large-mnli"
+
+
+def warmup_texts(n=4):
+    """A few real farmer queries to exercise the model before going live."""
+    return [example["text"] for example in load_split("validation")[:n]]
+
+
+class BackgroundModel:
+    """Classifier that loads on a background thread.
+
+    Until the main model is ready, ``predict`` answers from the cheap
+    ``fallback_factory`` model (results carry ``"fallback": True``). Stage
+    timings are measured from process start, so ``cold_start_report``
+    shows where start-up time went.
+    """
+
+    def __init__(self, factory, fallback_factory=None, warmup=()):
+        self.model = None
+        self.fallback = None
+        self.error = None
+        self.ready = threading.Event()
+        self._factory = factory
+        self._fallback_factory = fallback_factory
+        self._warmup = list(warmup)
+        self._started = process_start_time()
+        self._timings = {"process_to_loader": time.time() - self._started}
+        self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+        self._thread.start()
+
+    @property
+    def is_ready(self):
+        return self.ready.is_set()
+
+    @property
+    def failed(self):
+        """Whether loading the main model raised; ``error`` holds the exception."""
+        return self.error is not None
+
+    def _mark(self, stage, since):
+        now = time.perf_counter()
+        self._timings[stage] = now - since
+        self._timings[f"{stage}_done_since_start"] = time.time() - self._started
+        return now
+
+    def _load(self):
+        try:
+            t = time.perf_counter()
+            if self._fallback_factory is not None:
+                self.fallback = self._fallback_factory()
+                t = self._mark("fallback_load", t)
+            model = self._factory()
+            t = self._mark("model_load", t)
+            if self._warmup:
+                if hasattr(model, "predict_batch"):
+                    model.predict_batch(self._warmup)
+                else:
+                    for text in self._warmup:
+                        model.predict(text)
+                t = self._mark("warmup", t)
+            self.model = model
+            self.ready.set()
+            print(f"Model ready: {self.cold_start_report()}")
+        except Exception as e:
+            self.error = e
+            traceback.print_exc()
+            print(f"Background model load failed: {e}; staying on the fallback model")
+            metrics.inc("model_load_failures_total", "Background model loads that raised")
+
+    def _fallback_results(self, texts):
+        if self.fallback is None:
+            return [
+                {"intent": "unknown", "score": 0.0, "all": [], "fallback": True}
+                for _ in texts
+            ]
+        return [dict(result, fallback=True) for result in self.fallback.predict_batch(texts)]
+
+    def _note_first_answer(self, stage):
+        key = f"first_{stage}_answer_since_start"
+        if key not in self._timings:
+            self._timings[key] = time.time() - self._started
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        texts = list(texts)
+        if self.model is None:
+            self._note_first_answer("fallback")
+            return self._fallback_results(texts)
+        self._note_first_answer("model")
+        if hasattr(self.model, "predict_batch"):
+            return self.model.predict_batch(texts)
+        return [self.model.predict(text) for text in texts]
+
+    def wait(self, timeout=None):
+        """Block until loading finishes (or fails); returns readiness."""
+        self._thread.join(timeout)
+        return self.is_ready
+
+    def cold_start_report(self):
+        """Seconds per start-up stage, plus milestones since process start."""
+        return {stage: round(seconds, 3) for stage, seconds in self._timings.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model snapshots and cold-start measurement")
+    parser.add_argument("command", choices=["snapshot", "coldstart"])
+    parser.add_argument("--model", default="facebook/bart-large-mnli")
+    parser.add_argument("--output-dir", default=DEFAULT_SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        snapshot_model(args.model, args.output_dir)
+    else:
+        from intent_classifier import KeywordIntentClassifier
+        from pipeline import build_classifier
+
+        loader = BackgroundModel(
+            build_classifier,
+            fallback_factory=KeywordIntentClassifier,
+            warmup=warmup_texts(),
+        )
+        while loader.fallback is None and loader.error is None and not loader.is_ready:
+            time.sleep(0.01)
+        print("First (fallback) answer:", loader.predict("Which fertilizer should I use for maize?")["intent"])
+        loader.wait()
+        print(loader.cold_start_report())
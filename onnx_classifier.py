@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+from batching import length_buckets
+from farming_data import load_split
+from sysinfo import rss_mb
+
+
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+
+def export_onnx(model_dir="./farming_model", output_dir="./farming_model_onnx", quantize=True):
+    """Export the fine-tuned model to ONNX, optionally with dynamic int8 weights.
+
+    Batch and sequence axes are dynamic so inference can pad to the longest
+    query instead of 128 tokens.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModelForSequenceClassification
+
+    print(f"Exporting {model_dir} to ONNX...")
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+
+    sample = tokenizer(["Which fertilizer should I use for maize?"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, FP32_FILE)
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=14,
+        )
+
+    if quantize:
+        print("Applying dynamic int8 quantization...")
+        quantize_dynamic(fp32_path, os.path.join(output_dir, INT8_FILE), weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(output_dir)
+    shutil.copy(os.path.join(model_dir, "label_mappings.json"), output_dir)
+    print(f"Saved ONNX model to {output_dir}")
+    return output_dir
+
+
+class OnnxFarmingIntentClassifier:
+    """ONNX Runtime counterpart of FarmingIntentClassifier for CPU serving."""
+
+    def __init__(self, model_dir="./farming_model_onnx", quantized=True, num_threads=None, max_length=128):
+        print(f"Loading ONNX model from {model_dir}")
+        with open(os.path.join(model_dir, "label_mappings.json"), "r") as f:
+            mappings = json.load(f)
+        self.label_to_intent = {int(k): v for k, v in mappings["label_to_intent"].items()}
+        self.intent_to_label = {k: int(v) for k, v in mappings["intent_to_label"].items()}
+        self.num_labels = len(self.label_to_intent)
+        self.max_length = max_length
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = INT8_FILE if quantized else FP32_FILE
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+
+    def predict(self, text):
+        """Predict intent for a given text."""
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts, batch_size=32):
+        """Predict intents, padding each length bucket only to its longest text."""
+        texts = list(texts)
+        results = [None] * len(texts)
+        for indices in length_buckets(texts, batch_size):
+            inputs = self.tokenizer(
+                [texts[i] for i in indices],
+                return_tensors="np",
+                truncation=True,
+                padding=True,
+                max_length=self.max_length
+            )
+            logits = self.session.run(
+                ["logits"],
+                {
+                    "input_ids": inputs["input_ids"].astype(np.int64),
+                    "attention_mask": inputs["attention_mask"].astype(np.int64),
+                },
+            )[0]
+            exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probabilities = exp / exp.sum(axis=1, keepdims=True)
+
+            for i, probs in zip(indices, probabilities):
+                predicted_class = int(np.argmax(probs))
+                results[i] = {
+                    "intent": self.label_to_intent[predicted_class],
+                    "score": float(probs[predicted_class]),
+                    "all": [(self.label_to_intent[j], float(p)) for j, p in enumerate(probs)]
+                }
+        return results
+
+
+def _timed_predictions(classifier, texts, gold):
+    results, latencies = [], []
+    for text in texts:
+        start = time.perf_counter()
+        results.append(classifier.predict(text))
+        latencies.append(1000 * (time.perf_counter() - start))
+    latencies.sort()
+    return results, {
+        "accuracy": float(np.mean([r["intent"] == g for r, g in zip(results, gold)])),
+        "mean_latency_ms": sum(latencies) / len(latencies),
+        "p95_latency_ms": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def compare(model_dir="./farming_model", onnx_dir="./farming_model_onnx", quantized=True, split="test"):
+    """Check ONNX parity against PyTorch and compare latency and memory."""
+    import torch  # noqa: F401  (import cost kept out of the memory deltas)
+    from train_snips import FarmingIntentClassifier
+
+    examples = load_split(split)
+    texts = [example["text"] for example in examples]
+    gold = [example["intent"] for example in examples]
+
+    before = rss_mb()
+    torch_clf = FarmingIntentClassifier()
+    torch_clf.load_model(model_dir)
+    torch_mem = rss_mb() - before
+    torch_clf.predict(texts[0])  # warmup
+    torch_results, torch_stats = _timed_predictions(torch_clf, texts, gold)
+
+    before = rss_mb()
+    onnx_clf = OnnxFarmingIntentClassifier(onnx_dir, quantized=quantized)
+    onnx_mem = rss_mb() - before
+    onnx_clf.predict(texts[0])
+    onnx_results, onnx_stats = _timed_predictions(onnx_clf, texts, gold)
+
+    agreement = np.mean([a["intent"] == b["intent"] for a, b in zip(torch_results, onnx_results)])
+    max_diff = max(
+        abs(pa - pb)
+        for a, b in zip(torch_results, onnx_results)
+        for (_, pa), (_, pb) in zip(a["all"], b["all"])
+    )
+    report = {
+        "split": split,
+        "quantized": quantized,
+        "intent_agreement": float(agreement),
+        "max_prob_diff": float(max_diff),
+        "torch": dict(torch_stats, load_rss_mb=torch_mem),
+        "onnx": dict(onnx_stats, load_rss_mb=onnx_mem),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ONNX export and inference for the fine-tuned model")
+    parser.add_argument("command", choices=["export", "compare"])
+    parser.add_argument("--model-dir", default="./farming_model")
+    parser.add_argument("--onnx-dir", default="./farming_model_onnx")
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--split", default="test")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model_dir, args.onnx_dir, quantize=not args.no_quantize)
+    else:
+        compare(args.model_dir, args.onnx_dir, quantized=not args.no_quantize, split=args.split)
@@ -0,0 +1,370 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+import profiler as profiling
+import query_log
+from batching import BatchingScheduler
+from entity_extractor import extract_crop
+from intent_classifier import RuleIntentClassifier
+from query_cache import QueryCache, normalize_query
+from responder import build_response, knowledge_version
+
+
+_UNSET = object()
+
+
+class ChatPipeline:
+    """Classify intent -> extract crop -> build advice for one query.
+
+    ``classifier`` is anything with a ``predict(text)`` method returning the
+    ``{"intent", "score", "all"}`` dict (a classifier or a BatchingScheduler).
+    With a ``QueryCache``, repeat questions skip the model entirely. Each
+    stage is timed into ``metrics.REGISTRY``; answers carry ``timings_ms``.
+
+    With ``budget_ms`` and a classifier that can ``submit`` (the batching
+    scheduler), a turn whose model result would arrive too late is answered
+    from the ``degraded`` classifier (keyword rules by default) instead;
+    such answers carry ``"degraded": True``. With a ``query_log.QueryLog``
+    every answer is also queued for the background log writer, and with a
+    ``profiler.Profiler`` sampled slow turns are profiled.
+    """
+
+    def __init__(self, classifier, cache=None, low_confidence=0.5, ready=None, budget_ms=None, degraded=None,
+                 log=None, profiler=None, load_error=None):
+        self.classifier = classifier
+        self.cache = cache
+        self.low_confidence = low_confidence
+        self._ready = ready
+        self._load_error = load_error
+        self.budget_ms = budget_ms
+        self.degraded = degraded or RuleIntentClassifier()
+        # Late model results are turned into cached answers here; the
+        # thread only starts on the first one.
+        self._late_results = ThreadPoolExecutor(max_workers=1, thread_name_prefix="late-results")
+        self.log = log
+        self.profiler = profiler
+        if cache is not None and cache.version is None:
+            cache.version = self.version
+
+    def version(self):
+        """Changes whenever the classifier or the knowledge base changes."""
+        classifier = getattr(self.classifier, "classifier", self.classifier)
+        return (type(classifier).__name__, id(classifier), knowledge_version())
+
+    def is_ready(self):
+        """Whether the main model (not a warm-up fallback) is answering."""
+        return self._ready() if self._ready is not None else True
+
+    def load_error(self):
+        """Why the main model failed to load, or None (loaded or still loading)."""
+        return self._load_error() if self._load_error is not None else None
+
+    def answer(self, query, context_crop=None, budget_ms=None, region=None, season=None):
+        """Return the answer dict: query, intent, scores, crop, advice, cached.
+
+        ``context_crop`` (the crop of an earlier turn) is used when the query
+        names none, so follow-ups like "and its irrigation?" resolve.
+        ``budget_ms`` overrides the pipeline's latency budget for this turn;
+        ``region`` and ``season`` pick regional advice where the store has it.
+        """
+        where = (region, season) if region or season else None
+        started = time.perf_counter()
+        capture = self.profiler.start() if self.profiler is not None else None
+        timings = {}
+        with metrics.timed("total", timings):
+            try:
+                crop, context_crop, result = self._lookup(query, context_crop, where, timings)
+                if result is None:
+                    budget_ms = self.budget_ms if budget_ms is None else budget_ms
+                    with metrics.timed("classify", timings):
+                        if budget_ms and hasattr(self.classifier, "submit"):
+                            deadline = started + budget_ms / 1000.0
+                            intent_res = self._classify_by(deadline, query, crop, context_crop, where)
+                        else:
+                            intent_res = self.classifier.predict(query)
+                    result = self._complete(query, intent_res, timings, crop, context_crop, where)
+            except Exception:
+                metrics.inc("chat_errors_total", "Chat turns that raised")
+                if capture is not None:
+                    self.profiler.finish(capture, {"query": query}, timings)
+                raise
+        result["timings_ms"] = timings
+        if capture is not None:
+            self.profiler.finish(capture, result)
+        if self.log is not None:
+            self.log.record(result)
+        return result
+
+    async def answer_async(self, query, context_crop=None, budget_ms=None, region=None, season=None, executor=None):
+        """``answer`` for an event loop: waits for the model without holding a thread.
+
+        The query goes to the batching scheduler and its future is awaited,
+        so concurrent turns fill model batches; only building the answer
+        runs in ``executor``. Without a scheduler, or while the profiler is
+        on (it samples a request thread), the whole turn runs in ``executor``.
+        """
+        loop = asyncio.get_running_loop()
+        if not hasattr(self.classifier, "submit") or (self.profiler is not None and self.profiler.enabled):
+            return await loop.run_in_executor(executor, self.answer, query, context_crop, budget_ms, region, season)
+        where = (region, season) if region or season else None
+        started = time.perf_counter()
+        timings = {}
+        with metrics.timed("total", timings):
+            try:
+                crop, context_crop, result = self._lookup(query, context_crop, where, timings)
+                if result is None:
+                    budget_ms = self.budget_ms if budget_ms is None else budget_ms
+                    with metrics.timed("classify", timings):
+                        if budget_ms:
+                            deadline = started + budget_ms / 1000.0
+                            intent_res = await self._classify_by_async(deadline, query, crop, context_crop, where)
+                        else:
+                            intent_res = await asyncio.wrap_future(self.classifier.submit(query))
+                    result = await loop.run_in_executor(
+                        executor, self._complete, query, intent_res, timings, crop, context_crop, where
+                    )
+            except Exception:
+                metrics.inc("chat_errors_total", "Chat turns that raised")
+                raise
+        result["timings_ms"] = timings
+        if self.log is not None:
+            self.log.record(result)
+        return result
+
+    def answer_batch(self, queries):
+        """Answer many queries, classifying all cache misses in one batch."""
+        queries = list(queries)
+        results = [None] * len(queries)
+        misses = []
+        try:
+            for i, query in enumerate(queries):
+                results[i] = self._cached(query, {})
+                if results[i] is None:
+                    misses.append(i)
+            if misses:
+                with metrics.timed("classify_batch"):
+                    intent_results = self.classifier.predict_batch([queries[i] for i in misses])
+                for i, intent_res in zip(misses, intent_results):
+                    results[i] = self._complete(queries[i], intent_res, {})
+        except Exception:
+            metrics.inc("chat_errors_total", "Chat turns that raised")
+            raise
+        if self.log is not None:
+            for result in results:
+                self.log.record(result)
+        return results
+
+    async def answer_batch_async(self, queries, executor=None):
+        """``answer_batch`` for an event loop; see ``answer_async``."""
+        loop = asyncio.get_running_loop()
+        if not hasattr(self.classifier, "submit"):
+            return await loop.run_in_executor(executor, self.answer_batch, queries)
+        queries = list(queries)
+        try:
+            results = [self._cached(query, {}) for query in queries]
+            misses = [i for i, result in enumerate(results) if result is None]
+            if misses:
+                with metrics.timed("classify_batch"):
+                    intent_results = await asyncio.gather(
+                        *(asyncio.wrap_future(self.classifier.submit(queries[i])) for i in misses)
+                    )
+                completed = await loop.run_in_executor(executor, lambda: [
+                    self._complete(queries[i], intent_res, {}) for i, intent_res in zip(misses, intent_results)
+                ])
+                for i, result in zip(misses, completed):
+                    results[i] = result
+        except Exception:
+            metrics.inc("chat_errors_total", "Chat turns that raised")
+            raise
+        if self.log is not None:
+            for result in results:
+                self.log.record(result)
+        return results
+
+    @staticmethod
+    def _cache_key(query, context_crop=None, where=None):
+        key = normalize_query(query)
+        # A carried-over crop or a region/season changes the answer, so they are part of the key.
+        if context_crop:
+            key = f"{key}\x00{context_crop}"
+        if where:
+            key = f"{key}\x01{where[0] or ''}\x01{where[1] or ''}"
+        return key
+
+    def _lookup(self, query, context_crop, where, timings):
+        """``(crop, context_crop, cached answer or None)`` for a turn."""
+        crop = _UNSET
+        if context_crop:
+            # Only needed up front to pick the cache key.
+            with metrics.timed("extract_crop", timings):
+                crop = extract_crop(query)
+            if crop:
+                context_crop = None
+            else:
+                crop = context_crop
+        return crop, context_crop, self._cached(query, timings, context_crop, where)
+
+    def _cached(self, query, timings, context_crop=None, where=None):
+        if self.cache is None:
+            return None
+        with metrics.timed("cache_lookup", timings):
+            hit = self.cache.get(self._cache_key(query, context_crop, where))
+        metrics.inc("chat_cache_requests_total", "Query cache lookups", result="hit" if hit else "miss")
+        if hit is None:
+            return None
+        return dict(hit, query=query, cached=True)
+
+    def _classify_by(self, deadline, query, crop, context_crop, where):
+        """Model result if it can arrive before ``deadline``, else a degraded one."""
+        remaining = deadline - time.perf_counter()
+        if not self._can_make(remaining):
+            return self._queue_miss(query, crop, context_crop, where)
+        future = self.classifier.submit(query)
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeout:
+            return self._timed_out(future, query, crop, context_crop, where)
+
+    async def _classify_by_async(self, deadline, query, crop, context_crop, where):
+        """``_classify_by`` awaiting the model future instead of blocking on it."""
+        remaining = deadline - time.perf_counter()
+        if not self._can_make(remaining):
+            return self._queue_miss(query, crop, context_crop, where)
+        future = self.classifier.submit(query)
+        # asyncio.wait doesn't cancel on timeout, so the late result can still be cached.
+        done, _ = await asyncio.wait([asyncio.wrap_future(future)], timeout=remaining)
+        if not done:
+            return self._timed_out(future, query, crop, context_crop, where)
+        return future.result()
+
+    def _can_make(self, remaining):
+        estimate = self.classifier.estimated_wait() if hasattr(self.classifier, "estimated_wait") else 0.0
+        return remaining > 0 and estimate <= remaining
+
+    def _queue_miss(self, query, crop, context_crop, where):
+        # The queue is too deep to make it; don't add to it. If the model
+        # is in fact idle the estimate is stale: send this query as a
+        # probe anyway, so the estimate is refreshed and the answer cached.
+        metrics.inc("chat_deadline_misses_total", "Turns whose model result would be late", reason="queue")
+        if getattr(self.classifier, "is_idle", lambda: False)():
+            future = self.classifier.submit(query)
+            future.add_done_callback(lambda f: self._late(f, query, crop, context_crop, where))
+        return self._degrade(query)
+
+    def _timed_out(self, future, query, crop, context_crop, where):
+        metrics.inc("chat_deadline_misses_total", "Turns whose model result would be late", reason="timeout")
+        if self.cache is None:
+            future.cancel()
+        else:
+            # Keep the late answer for the next time this is asked.
+            future.add_done_callback(lambda f: self._late(f, query, crop, context_crop, where))
+        return self._degrade(query)
+
+    def _degrade(self, query):
+        metrics.inc("chat_degraded_answers_total", "Answers from the degraded path after a deadline miss")
+        return dict(self.degraded.predict(query), degraded=True)
+
+    def _late(self, future, query, crop, context_crop, where):
+        # Runs on the batching thread: hand off, so building the answer
+        # (crop extraction, retrieval) doesn't delay the next model batch.
+        if self.cache is not None and not future.cancelled():
+            self._late_results.submit(self._store_late, future, query, crop, context_crop, where)
+
+    def _store_late(self, future, query, crop, context_crop, where):
+        if future.exception() is not None:
+            return
+        intent_res = future.result()
+        if "error" not in intent_res and not intent_res.get("fallback"):
+            result = self._result(query, intent_res, {}, crop, context_crop, where)
+            self.cache.put(self._cache_key(query, context_crop, where), result)
+
+    def _result(self, query, intent_res, timings, crop=_UNSET, context_crop=None, where=None):
+        intent = intent_res.get("intent")
+        if crop is _UNSET:
+            with metrics.timed("extract_crop", timings):
+                crop = extract_crop(query)
+        with metrics.timed("build_response", timings):
+            advice = build_response(intent, crop, query, *(where or ()))
+        return {
+            "query": query,
+            "intent": intent,
+            "intent_score": intent_res.get("score"),
+            "intent_scores": intent_res.get("all", []),
+            "crop": crop,
+            "crop_from_context": context_crop is not None,
+            "advice": advice,
+            "cached": False,
+        }
+
+    def _complete(self, query, intent_res, timings, crop=_UNSET, context_crop=None, where=None):
+        score = intent_res.get("score") or 0.0
+        if "error" in intent_res:
+            metrics.inc("chat_classifier_errors_total", "Classifier calls that failed")
+        if intent_res.get("fallback"):
+            metrics.inc("chat_fallback_answers_total", "Answers from the fallback classifier")
+        if score < self.low_confidence:
+            metrics.inc("chat_low_confidence_total", "Answers below the confidence threshold")
+
+        result = self._result(query, intent_res, timings, crop, context_crop, where)
+        if intent_res.get("degraded"):
+            result["degraded"] = True
+        if intent_res.get("fallback"):
+            result["fallback"] = True
+        # Don't pin classifier failures, warm-up fallback or degraded answers in the cache.
+        if (self.cache is not None and "error" not in intent_res and not intent_res.get("fallback")
+                and not intent_res.get("degraded")):
+            self.cache.put(self._cache_key(query, context_crop, where), dict(result))
+        return result
+
+
+def build_classifier():
+    """The intent backend selected by INTENT_BACKEND (see backends.py)."""
+    import backends
+
+    return backends.create()
+
+
+def build_pipeline(classifier=None):
+    """Model -> batching scheduler -> cached pipeline.
+
+    Shared by the Streamlit app and the HTTP service so both answer the
+    same way. Without ``classifier`` the main model is loaded in the
+    background and the keyword model answers until it is warmed up.
+    """
+    ready = load_error = None
+    if classifier is None:
+        import autotune
+        from intent_classifier import KeywordIntentClassifier
+        from model_loader import BackgroundModel, warmup_texts
+
+        # Threads, batch size and model variant tuned for this host and backend, if any.
+        autotune.apply_profile()
+
+        classifier = BackgroundModel(
+            build_classifier,
+            fallback_factory=KeywordIntentClassifier,
+            warmup=warmup_texts(),
+        )
+        ready = lambda: classifier.is_ready  # noqa: E731
+        load_error = lambda: str(classifier.error) if classifier.failed else None  # noqa: E731
+    # PROFILE_DIR enables slow-request profiling (off until toggled on).
+    profiler = profiling.from_env()
+    # Concurrent requests land in the same model batch.
+    scheduler = BatchingScheduler(
+        profiler.wrap(classifier) if profiler is not None else classifier,
+        max_batch_size=int(os.environ.get("BATCH_MAX_SIZE", "16")),
+        max_wait_ms=float(os.environ.get("BATCH_MAX_WAIT_MS", "10")),
+    )
+    # Repeat questions skip the model entirely.
+    cache = QueryCache(
+        maxsize=int(os.environ.get("QUERY_CACHE_SIZE", "4096")),
+        ttl=float(os.environ.get("QUERY_CACHE_TTL", "3600")),
+    )
+    # Turns that would wait longer than this get a keyword-rule answer.
+    budget_ms = float(os.environ.get("LATENCY_BUDGET_MS", "0")) or None
+    # QUERY_LOG_DIR turns on the background query/answer log.
+    return ChatPipeline(scheduler, cache=cache, ready=ready, budget_ms=budget_ms, log=query_log.from_env(),
+                        profiler=profiler, load_error=load_error)
@@ -0,0 +1,297 @@
+import argparse
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+import autotune
+from farming_data import load_split
+from model_loader import warmup_texts
+from pipeline import build_classifier, build_pipeline
+from sysinfo import memory_breakdown
+
+
+# Forked children inherit the parent's loaded model; spawn would reload it.
+_FORK = multiprocessing.get_context("fork")
+
+
+def _set_torch_threads(threads):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def threads_per_worker(workers, threads=None):
+    """Torch intra-op threads per worker so N workers don't oversubscribe cores.
+
+    An autotune profile tuned for the same worker count takes precedence
+    over an even split of the cores.
+    """
+    return threads or autotune.profile_threads(workers) or max(1, (os.cpu_count() or 1) // workers)
+
+
+def load_shared_classifier():
+    """Load and warm the classifier in the parent, ready to be forked.
+
+    Warm-up runs single-threaded so no OpenMP pool exists at fork time
+    (a pool inherited by a child can deadlock it). ``gc.freeze`` moves
+    everything loaded so far out of the collector's reach, so collections
+    in the workers don't touch the shared pages and copy them.
+    """
+    _set_torch_threads(1)
+    classifier = build_classifier()
+    texts = warmup_texts()
+    if hasattr(classifier, "predict_batch"):
+        classifier.predict_batch(texts)
+    else:
+        for text in texts:
+            classifier.predict(text)
+    gc.collect()
+    gc.freeze()
+    return classifier
+
+
+class RemoteClassifier:
+    """Worker-side proxy for a classifier living in the model-owner process.
+
+    Requests go out on the shared ``requests`` queue tagged with this
+    worker's id; a dispatcher thread matches replies on the worker's own
+    ``responses`` queue back to the waiting callers. Threads don't survive
+    fork, so the dispatcher starts on first use inside the worker.
+    """
+
+    def __init__(self, worker_id, requests, responses):
+        self.worker_id = worker_id
+        self._requests = requests
+        self._responses = responses
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._dispatcher = None
+
+    def _dispatch(self):
+        while True:
+            request_id, results = self._responses.get()
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if isinstance(results, Exception):
+                future.set_exception(results)
+            else:
+                future.set_result(results)
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        future = Future()
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="owner-replies", daemon=True)
+                self._dispatcher.start()
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        self._requests.put((self.worker_id, request_id, list(texts)))
+        return future.result()
+
+
+def run_model_owner(classifier, requests, responses, max_batch_size=32):
+    """Serve classification requests from all workers with one model copy.
+
+    Requests that queued up while the model was busy are merged into one
+    batch, so the owner batches across workers, not just within one.
+    """
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        batch = [item]
+        size = len(item[2])
+        while size < max_batch_size:
+            try:
+                item = requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                requests.put(None)
+                break
+            batch.append(item)
+            size += len(item[2])
+
+        texts = [text for _, _, chunk in batch for text in chunk]
+        try:
+            results = classifier.predict_batch(texts)
+        except Exception as e:
+            for worker_id, request_id, _ in batch:
+                responses[worker_id].put((request_id, RuntimeError(str(e))))
+            continue
+        offset = 0
+        for worker_id, request_id, chunk in batch:
+            responses[worker_id].put((request_id, results[offset:offset + len(chunk)]))
+            offset += len(chunk)
+
+
+def _owner_main(requests, responses, threads, max_batch_size):
+    _set_torch_threads(threads)
+    run_model_owner(load_shared_classifier(), requests, responses, max_batch_size)
+
+
+def _serve_worker(sock, classifier, threads):
+    import uvicorn
+    from server import create_app
+
+    _set_torch_threads(threads)
+    app = create_app(lambda: build_pipeline(classifier))
+    uvicorn.Server(uvicorn.Config(app, fd=sock.fileno(), log_level="warning")).run()
+
+
+def _bind(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(workers=2, host="0.0.0.0", port=8000, threads=None, owner=False):
+    """Run the HTTP service in ``workers`` forked processes on one socket.
+
+    By default every worker shares the parent's model copy-on-write. With
+    ``owner=True`` a single model-owner process holds the model and the
+    workers send it batches over multiprocessing queues.
+    """
+    sock = _bind(host, port)
+    processes = []
+    if owner:
+        requests = _FORK.Queue()
+        responses = [_FORK.Queue() for _ in range(workers)]
+        processes.append(_FORK.Process(
+            target=_owner_main, name="model-owner",
+            args=(requests, responses, threads or os.cpu_count() or 1, int(os.environ.get("BATCH_MAX_SIZE", "16"))),
+        ))
+        classifiers = [RemoteClassifier(i, requests, responses[i]) for i in range(workers)]
+        worker_threads = 1
+    else:
+        classifier = load_shared_classifier()
+        classifiers = [classifier] * workers
+        worker_threads = threads_per_worker(workers, threads)
+    for i, classifier in enumerate(classifiers):
+        processes.append(_FORK.Process(
+            target=_serve_worker, name=f"worker-{i}", args=(sock, classifier, worker_threads),
+        ))
+
+    for process in processes:
+        process.start()
+    mode = "model-owner" if owner else "copy-on-write"
+    print(f"Serving on http://{host}:{port} with {workers} workers ({mode}, {worker_threads} torch threads each)")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    finally:
+        sock.close()
+
+
+def _bench_worker(classifier, texts, seconds, batch_size, threads, results):
+    _set_torch_threads(threads)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    batches = itertools.cycle([texts[i:i + batch_size] for i in range(0, len(texts), batch_size)])
+    while time.perf_counter() < deadline:
+        batch = next(batches)
+        classifier.predict_batch(batch)
+        count += len(batch)
+    results.put({"queries": count, "memory": memory_breakdown()})
+
+
+def _measure(classifier, workers, texts, seconds, batch_size, threads, owner):
+    results = _FORK.Queue()
+    processes = []
+    owner_process = None
+    if owner:
+        requests = _FORK.Queue()
+        responses = [_FORK.Queue() for _ in range(workers)]
+        owner_process = _FORK.Process(
+            target=run_model_owner, args=(classifier, requests, responses, batch_size * workers)
+        )
+        owner_process.start()
+        classifiers = [RemoteClassifier(i, requests, responses[i]) for i in range(workers)]
+        worker_threads = 1
+    else:
+        classifiers = [classifier] * workers
+        worker_threads = threads_per_worker(workers, threads)
+
+    for worker_classifier in classifiers:
+        process = _FORK.Process(
+            target=_bench_worker,
+            args=(worker_classifier, texts, seconds, batch_size, worker_threads, results),
+        )
+        process.start()
+        processes.append(process)
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if owner_process is not None:
+        requests.put(None)
+        owner_process.join()
+
+    memory = [r["memory"] for r in reports]
+    return {
+        "mode": "owner" if owner else "cow",
+        "workers": workers,
+        "torch_threads_per_worker": worker_threads,
+        "queries_per_sec": round(sum(r["queries"] for r in reports) / seconds, 1),
+        "worker_rss_mb": round(sum(m.get("rss_mb", 0.0) for m in memory) / len(memory), 1),
+        "worker_pss_mb": round(sum(m.get("pss_mb", 0.0) for m in memory) / len(memory), 1),
+        "worker_private_mb": round(sum(m.get("uss_mb", 0.0) for m in memory) / len(memory), 1),
+    }
+
+
+def report(worker_counts=(1, 2, 4), seconds=10.0, batch_size=8, threads=None, owner=False):
+    """Per-worker memory and aggregate throughput as the worker count grows.
+
+    PSS charges each worker its share of the copy-on-write model pages, so
+    ``worker_pss_mb`` is what one more worker really costs.
+    """
+    classifier = load_shared_classifier()
+    texts = [row["text"] for split in ("train", "validation", "test") for row in load_split(split)]
+    rows = []
+    for workers in worker_counts:
+        row = _measure(classifier, workers, texts, seconds, batch_size, threads, owner)
+        print(json.dumps(row))
+        rows.append(row)
+    return {"parent_memory": memory_breakdown(), "runs": rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-fork serving with one shared copy of the model")
+    parser.add_argument("command", choices=["serve", "report"])
+    parser.add_argument("--workers", default="2",
+                        help="worker count; for report, a comma-separated list like 1,2,4,8")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--owner", action="store_true",
+                        help="one model-owner process serves all workers over queues")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(int(args.workers), args.host, args.port, args.threads, args.owner)
+    else:
+        counts = [int(n) for n in args.workers.split(",")]
+        print(json.dumps(report(counts, args.seconds, args.batch_size, args.threads, args.owner), indent=2))
@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import metrics
+
+
+# Threads whose stacks are sampled alongside the request's own: the
+# batching worker runs the model for every request.
+_MODEL_THREADS = ("intent-batcher",)
+
+
+class _Capture:
+    __slots__ = ("id", "thread_id", "started", "stacks", "samples", "torch_profiles")
+
+    def __init__(self):
+        self.id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.samples = 0
+        self.torch_profiles = []
+
+
+class Profiler:
+    """Sampled request profiling that only keeps the slow requests.
+
+    ``start``/``finish`` bracket one request. A ``sample_rate`` share of
+    requests is watched: a sampler thread records the Python stacks of the
+    request thread and the model thread every ``interval_ms``, and model
+    batches run meanwhile are recorded with ``torch.profiler`` (through
+    ``wrap``). Only captures slower than ``slow_ms`` are written, as folded
+    stacks (flamegraph.pl / speedscope), Chrome traces of the torch
+    operators and a JSON file with the query, intent and stage timings.
+    The oldest captures are deleted once the directory exceeds ``max_mb``.
+    """
+
+    def __init__(self, directory, enabled=False, sample_rate=0.01, slow_ms=1000.0, max_mb=200.0, interval_ms=5.0):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.interval = interval_ms / 1000.0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sampler = None
+
+    def settings(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "max_mb": self.max_bytes / (1024 * 1024),
+            "directory": self.directory,
+        }
+
+    def configure(self, enabled=None, sample_rate=None, slow_ms=None):
+        """Change settings at runtime; ``None`` leaves a setting as it is."""
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        if slow_ms is not None:
+            self.slow_ms = float(slow_ms)
+        print(f"Profiler settings: {self.settings()}")
+        return self.settings()
+
+    def install_signal_toggle(self, signum=getattr(signal, "SIGUSR2", None)):
+        """Flip ``enabled`` on ``signum``; only possible from the main thread."""
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, lambda *_: self.configure(enabled=not self.enabled))
+        return True
+
+    def start(self):
+        """Begin watching the current request, or return None if it isn't sampled."""
+        if not self.enabled or getattr(self._local, "capture", None) is not None:
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+        capture = _Capture()
+        self._local.capture = capture
+        with self._lock:
+            self._active[capture.id] = capture
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+                self._sampler.start()
+        return capture
+
+    def finish(self, capture, result=None, timings=None):
+        """Stop ``capture``; write it if the request was slow. Returns its path or None."""
+        if capture is None:
+            return None
+        total_ms = 1000 * (time.perf_counter() - capture.started)
+        self._local.capture = None
+        with self._lock:
+            self._active.pop(capture.id, None)
+        if total_ms < self.slow_ms:
+            return None
+        try:
+            path = self._write(capture, total_ms, result or {}, timings or {})
+            self._enforce_cap()
+        except OSError as e:
+            print(f"Profiler write failed: {e}", file=sys.stderr)
+            return None
+        metrics.inc("profiler_captures_total", "Slow requests written by the profiler")
+        return path
+
+    def wrap(self, classifier):
+        """Classifier wrapper recording model batches for watched requests."""
+        return ProfiledClassifier(classifier, self)
+
+    def captures(self):
+        """Saved capture metadata, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            meta = os.path.join(self.directory, name, "capture.json")
+            if os.path.exists(meta):
+                with open(meta, "r", encoding="utf-8") as f:
+                    found.append(json.load(f))
+        return found
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+                if not active:
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            # A request thread that died without finish() (e.g. a Streamlit
+            # script that raised) would otherwise keep the sampler running.
+            with self._lock:
+                for capture in active:
+                    if capture.thread_id not in names:
+                        self._active.pop(capture.id, None)
+            active = [capture for capture in active if capture.thread_id in names]
+            model_threads = [ident for ident, name in names.items() if name.startswith(_MODEL_THREADS)]
+            for capture in active:
+                capture.samples += 1
+                for ident in [capture.thread_id] + model_threads:
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        capture.stacks[_fold(names.get(ident, str(ident)), frame)] += 1
+
+    def _record_model_batch(self, profile):
+        with self._lock:
+            for capture in self._active.values():
+                capture.torch_profiles.append(profile)
+
+    def _model_watched(self):
+        return bool(self._active)
+
+    def _write(self, capture, total_ms, result, timings):
+        path = os.path.join(self.directory, capture.id)
+        os.makedirs(path, exist_ok=True)
+        files = {"stacks": "stacks.folded"}
+        with open(os.path.join(path, files["stacks"]), "w", encoding="utf-8") as f:
+            for stack, count in capture.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        for i, profile in enumerate(capture.torch_profiles):
+            name = f"torch-{i}.json"
+            profile.export_chrome_trace(os.path.join(path, name))
+            files.setdefault("torch_traces", []).append(name)
+        meta = {
+            "id": capture.id,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "query": result.get("query"),
+            "intent": result.get("intent"),
+            "intent_score": result.get("intent_score"),
+            "crop": result.get("crop"),
+            "cached": result.get("cached"),
+            "degraded": result.get("degraded", False),
+            "total_ms": round(total_ms, 3),
+            "slow_ms": self.slow_ms,
+            "timings_ms": dict(result.get("timings_ms") or {}, **timings),
+            "samples": capture.samples,
+            "interval_ms": 1000 * self.interval,
+            "files": files,
+        }
+        with open(os.path.join(path, "capture.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return path
+
+    def _enforce_cap(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class ProfiledClassifier:
+    """Runs ``predict_batch`` under ``torch.profiler`` while a request is watched."""
+
+    def __init__(self, classifier, profiler):
+        self.classifier = classifier
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.classifier, name)
+
+    def predict(self, text):
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts):
+        if not self.profiler._model_watched():
+            return self.classifier.predict_batch(texts)
+        try:
+            from torch.profiler import ProfilerActivity, profile
+        except ImportError:
+            return self.classifier.predict_batch(texts)
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+            results = self.classifier.predict_batch(texts)
+        self.profiler._record_model_batch(prof)
+        return results
+
+
+def _fold(thread_name, frame):
+    """One folded-stack line, root first: ``thread;file:function;...``."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    parts.append(thread_name)
+    return ";".join(reversed(parts))
+
+
+def from_env():
+    """A ``Profiler`` writing to PROFILE_DIR, or None when that isn't set."""
+    directory = os.environ.get("PROFILE_DIR")
+    if not directory:
+        return None
+    profiler = Profiler(
+        directory,
+        enabled=os.environ.get("PROFILE_ENABLED", "0") != "0",
+        sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0.01")),
+        slow_ms=float(os.environ.get("PROFILE_SLOW_MS", "1000")),
+        max_mb=float(os.environ.get("PROFILE_MAX_MB", "200")),
+        interval_ms=float(os.environ.get("PROFILE_INTERVAL_MS", "5")),
+    )
+    profiler.install_signal_toggle()
+    return profiler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or summarize saved slow-request profiles")
+    parser.add_argument("command", choices=["list", "top"])
+    parser.add_argument("--dir", default=os.environ.get("PROFILE_DIR", "profiles"))
+    parser.add_argument("--id", default=None, help="top: capture id (default: newest)")
+    parser.add_argument("-n", type=int, default=15, help="top: functions to show")
+    args = parser.parse_args()
+
+    captures = Profiler(args.dir).captures()
+    if args.command == "list":
+        for meta in captures:
+            print(f"{meta['id']}  {meta['total_ms']:9.1f}ms  {meta['intent'] or '-':15s} {meta['query']!r}")
+    elif captures:
+        meta = next((m for m in captures if m["id"] == args.id), captures[0])
+        print(f"{meta['id']}: {meta['total_ms']:.1f}ms, stages {meta['timings_ms']}")
+        # Self time per function: the leaf of every sampled stack.
+        leaves = Counter()
+        with open(os.path.join(args.dir, meta["id"], meta["files"]["stacks"]), "r", encoding="utf-8") as f:
+            for line in f:
+                stack, count = line.rsplit(" ", 1)
+                leaves[stack.rsplit(";", 1)[-1]] += int(count)
+        total = sum(leaves.values()) or 1
+        for function, count in leaves.most_common(args.n):
+            print(f"{100 * count / total:6.1f}%  {function}")
@@ -0,0 +1,89 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_UNSET = object()
+
+
+def normalize_query(text):
+    """Cache key for a query: lowercase, punctuation dropped, spaces collapsed."""
+    return " ".join(_NON_WORD.sub(" ", (text or "").lower()).split())
+
+
+class QueryCache:
+    """Thread-safe LRU cache with a size cap, TTL and hit/miss counters.
+
+    ``version`` is an optional zero-argument callable; whenever its return
+    value changes (new classifier, edited knowledge base) the cache is
+    emptied before the next lookup.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self._version = _UNSET
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        if self.version is None:
+            return
+        current = self.version()
+        if current != self._version:
+            if self._version is not _UNSET:
+                self._data.clear()
+                self.invalidations += 1
+            self._version = current
+
+    def get(self, key):
+        """Return the cached value for ``key`` or None."""
+        with self._lock:
+            self._check_version()
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._check_version()
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        """Zero the hit/miss/eviction counters; cached entries stay."""
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
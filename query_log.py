@@ -0,0 +1,241 @@
+import argparse
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+import metrics
+from farming_data import SPLITS
+from query_cache import normalize_query
+
+
+# Fields kept per answered query, in record order.
+_FIELDS = ("ts", "query", "intent", "score", "crop", "advice", "cached", "degraded", "fallback")
+
+
+class QueryLog:
+    """Background writer of answered queries to rotating gzip JSONL files.
+
+    ``record`` only appends a tuple to a bounded in-memory deque; a single
+    writer thread serializes and compresses queued records in batches.
+    When the deque is full the oldest record is dropped and counted, so a
+    slow disk never slows down a chat turn. A file is closed and a new one
+    started once it reaches ``max_bytes`` (compressed) or ``max_age``
+    seconds.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age=3600.0, capacity=10000,
+                 batch_size=256, flush_interval=1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = deque(maxlen=capacity)
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = None
+        self._raw = None
+        self._opened_at = 0.0
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.files = 0
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, name="query-log", daemon=True)
+        self._writer.start()
+
+    def record(self, result):
+        """Queue one answer dict from ``ChatPipeline``; never blocks."""
+        row = (
+            time.time(), result.get("query"), result.get("intent"), result.get("intent_score"),
+            result.get("crop"), result.get("advice"), result.get("cached", False), result.get("degraded", False),
+            result.get("fallback", False),
+        )
+        # Chat turns record from several threads; the counters need the lock.
+        with self._lock:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(row)
+            self.recorded += 1
+        if len(self._queue) >= self.batch_size:
+            self._wake.set()
+
+    def close(self):
+        """Write everything still queued and close the current file."""
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._writer.join()
+
+    def stats(self):
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "queued": len(self._queue),
+            "files": self.files,
+        }
+
+    def _open(self):
+        name = time.strftime("queries-%Y%m%d-%H%M%S", time.localtime()) + f"-{os.getpid()}-{self.files}.jsonl.gz"
+        self._raw = open(os.path.join(self.directory, name), "wb")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._opened_at = time.monotonic()
+        self.files += 1
+
+    def _rotate_if_due(self):
+        if self._file is not None and (self._raw.tell() >= self.max_bytes
+                                       or time.monotonic() - self._opened_at >= self.max_age):
+            self._close_file()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def _write(self, batch):
+        if self._file is None:
+            self._open()
+        lines = [json.dumps(dict(zip(_FIELDS, row)), ensure_ascii=False) for row in batch]
+        self._file.write(("\n".join(lines) + "\n").encode("utf-8"))
+        # A sync flush makes every batch readable even if the process dies.
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+        self.written += len(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                while self._queue:
+                    batch = []
+                    while self._queue and len(batch) < self.batch_size:
+                        batch.append(self._queue.popleft())
+                    self._write(batch)
+                    self._rotate_if_due()
+                self._rotate_if_due()
+            except OSError as e:
+                print(f"Query log write failed: {e}", file=sys.stderr)
+            metrics.REGISTRY.gauge("query_log_dropped", "Query log records dropped under pressure").set(self.dropped)
+            metrics.REGISTRY.gauge("query_log_written", "Query log records written").set(self.written)
+            if self._closed and not self._queue:
+                self._close_file()
+                return
+
+
+def from_env():
+    """A ``QueryLog`` in QUERY_LOG_DIR, or None when that isn't set."""
+    directory = os.environ.get("QUERY_LOG_DIR")
+    if not directory:
+        return None
+    log = QueryLog(
+        directory,
+        max_bytes=int(float(os.environ.get("QUERY_LOG_MAX_MB", "64")) * 1024 * 1024),
+        max_age=float(os.environ.get("QUERY_LOG_MAX_AGE", "3600")),
+        capacity=int(os.environ.get("QUERY_LOG_CAPACITY", "10000")),
+    )
+    atexit.register(log.close)
+    return log
+
+
+def read_logs(directory):
+    """Yield logged records from every file in ``directory``, oldest first.
+
+    A file cut short by a crash yields the records before the cut.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, "queries-*.jsonl.gz")), key=os.path.getmtime):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        pass
+        except (EOFError, OSError, zlib.error):
+            continue
+
+
+def export(directory, output_dir, min_score=0.8, split_ratios=(0.8, 0.1, 0.1)):
+    """Write confident logged queries as farming_dataset train/validation/test files.
+
+    Degraded and warm-up fallback answers and those below ``min_score``
+    are skipped; repeats of a question are kept once. Each question lands in the same split on
+    every export (hash of its normalized text), so re-exports don't leak
+    test questions into training.
+    """
+    seen = set()
+    splits = {split: [] for split in SPLITS}
+    bounds = [sum(split_ratios[:i + 1]) for i in range(len(SPLITS))]
+    for record in read_logs(directory):
+        text, intent = record.get("query"), record.get("intent")
+        if (not text or not intent or record.get("degraded") or record.get("fallback")
+                or (record.get("score") or 0.0) < min_score):
+            continue
+        key = normalize_query(text)
+        if key in seen:
+            continue
+        seen.add(key)
+        bucket = int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        split = next((split for split, bound in zip(SPLITS, bounds) if bucket <= bound), SPLITS[-1])
+        splits[split].append({"text": text.strip(), "intent": intent})
+
+    os.makedirs(output_dir, exist_ok=True)
+    for split, examples in splits.items():
+        with open(os.path.join(output_dir, f"{split}.json"), "w", encoding="utf-8") as f:
+            json.dump(examples, f, indent=2, ensure_ascii=False)
+    return {split: len(examples) for split, examples in splits.items()}
+
+
+def bench(n=100000, directory=None):
+    """Microseconds per ``record`` call on the request path, and drops."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = QueryLog(directory or tmp)
+        result = {"query": "Which fertilizer for maize?", "intent": "ask_fertilizer", "intent_score": 0.93,
+                  "crop": "maize", "advice": "Maize – Apply N-P-K 15:15:15 at planting.", "cached": False}
+        latencies = []
+        for _ in range(n):
+            t = time.perf_counter()
+            log.record(result)
+            latencies.append(time.perf_counter() - t)
+        log.close()
+        latencies.sort()
+        return {
+            "records": n,
+            "mean_us": round(1e6 * sum(latencies) / n, 3),
+            "p99_us": round(1e6 * latencies[int(0.99 * (n - 1))], 3),
+            **log.stats(),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query/answer log tools")
+    parser.add_argument("command", choices=["export", "stats", "bench"])
+    parser.add_argument("--log-dir", default=os.environ.get("QUERY_LOG_DIR", "query_logs"))
+    parser.add_argument("--output-dir", default="logged_dataset", help="export: where train/validation/test go")
+    parser.add_argument("--min-score", type=float, default=0.8, help="export: minimum intent score kept")
+    parser.add_argument("-n", type=int, default=100000, help="bench: records to log")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        counts = export(args.log_dir, args.output_dir, args.min_score)
+        print(f"Wrote {counts} to {args.output_dir}")
+    elif args.command == "stats":
+        records = list(read_logs(args.log_dir))
+        intents = {}
+        for record in records:
+            intents[record.get("intent")] = intents.get(record.get("intent"), 0) + 1
+        print(json.dumps({"records": len(records), "intents": intents}, indent=2))
+    else:
+        print(json.dumps(bench(args.n), indent=2))
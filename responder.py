@@ -1,5 +1,9 @@
+import os
 from typing import Optional
 
+from knowledge_store import DEFAULT_PATH, KnowledgeStore
+from retrieval import DEFAULT_INDEX_DIR, INTENT_WORDS, load_index, tokenize
+
 
 _CROP_SPECIFIC_INFO = {
     "ask_fertilizer": {
@@ -83,10 +87,49 @@ _CROP_SPECIFIC_INFO = {
     }
 }
 
+# Advice is served from the SQLite store when one has been built (see
+# knowledge_store.py); otherwise from the dict above.
+_STORE = KnowledgeStore(os.environ.get("KNOWLEDGE_DB", DEFAULT_PATH), knowledge=_CROP_SPECIFIC_INFO)
+# Free-form advice snippets (boron, nematodes, intercropping, ...) searched
+# when there is no canned answer.
+_INDEX = load_index(os.environ.get("RETRIEVAL_INDEX", DEFAULT_INDEX_DIR), knowledge=_CROP_SPECIFIC_INFO)
+_RETRIEVAL_MIN_SCORE = float(os.environ.get("RETRIEVAL_MIN_SCORE", "2.0"))
+
+_ASK_CROP_PROMPTS = {
+    "ask_fertilizer": "Which crop are you asking about? This helps me give specific fertilizer advice.",
+    "ask_pest": "Which crop has pests? Tell me the crop and I can recommend specific pest control.",
+    "ask_disease": "Which crop is affected? Pest management depends on the crop.",
+    "ask_irrigation": "Which crop needs irrigation? Water requirements vary by crop.",
+    "ask_planting": "Which crop are you planning to plant? Each has different planting dates & methods.",
+    "ask_harvesting": "Which crop are you harvesting? Harvest time varies significantly by crop.",
+    "ask_crop_info": "Which crop would you like to know about? Please mention the crop name.",
+}
+
+
+def knowledge_version() -> str:
+    """Version of the advice knowledge base, used to invalidate caches."""
+    return f"{_STORE.version}:{_INDEX.version}"
+
 
-def build_response(intent: str, crop: Optional[str], query: str) -> str:
+def advice_variants() -> dict:
+    """Regions and seasons the knowledge store has specific advice for."""
+    _STORE.maybe_reload()
+    return _STORE.variants()
+
+
+def retrieve_advice(query: str, intent: Optional[str] = None, crop: Optional[str] = None, k: int = 3) -> list:
+    """Top snippets for the query's topic words, filtered by intent and crop."""
+    # The crop is already a filter; matching it again would favour any
+    # general snippet that happens to name it.
+    ignore = INTENT_WORDS.union(tokenize(crop)) if crop else INTENT_WORDS
+    return _INDEX.search(query, intent, crop, k=k, min_score=_RETRIEVAL_MIN_SCORE, ignore=ignore)
+
+
+def build_response(intent: str, crop: Optional[str], query: str,
+                   region: Optional[str] = None, season: Optional[str] = None) -> str:
     """Build specific crop-based responses."""
     intent = intent or "unknown"
+    _STORE.maybe_reload()
     
     # Handle greeting/thanks
     if intent == "greeting":
@@ -95,38 +138,35 @@ def build_response(intent: str, crop: Optional[str], query: str) -> str:
     if intent == "thanks":
         return "You're welcome! Hope the advice is helpful. Ask more questions anytime!"
     
-    # For non-crop-specific intents, return default
-    if intent in ["ask_weather", "ask_seed", "ask_market", "ask_subsidy", "ask_equipment"]:
-        return _CROP_SPECIFIC_INFO.get(intent, {}).get("default", "Please rephrase your question.")
+    # Crop-specific advice, most specific region/season match first
+    if crop:
+        advice = _STORE.lookup(intent, crop, region, season)
+        if advice is not None:
+            return f"{crop.capitalize()} – {advice}"
+    
+    # For non-crop-specific intents (soil, weather, seed, market, ...), return default
+    default = _STORE.default(intent)
+    if default is not None:
+        return default
     
-    if intent == "ask_soil":
-        return _CROP_SPECIFIC_INFO.get("ask_soil", {}).get("default", "Soil health is critical.")
+    # A snippet about the question's topic beats the generic fallbacks below
+    hits = retrieve_advice(query, intent, crop, k=1)
+    if hits:
+        return hits[0]["text"]
     
-    # For crop-specific intents, get advice for the crop
-    if intent in _CROP_SPECIFIC_INFO:
-        crop_advice_dict = _CROP_SPECIFIC_INFO[intent]
-        
-        if crop and crop in crop_advice_dict:
-            return f"{crop.capitalize()} – {crop_advice_dict[crop]}"
-        elif crop:
+    if _STORE.is_crop_specific(intent):
+        if crop:
             # Fallback for crops not in database
-            return f"For {crop}: {_CROP_SPECIFIC_INFO[intent].get(list(crop_advice_dict.keys())[0], 'Please consult local extension services for specific advice.')}"
-        else:
+            advice = _STORE.fallback(intent) or "Please consult local extension services for specific advice."
+            return f"For {crop}: {advice}"
+        if intent in _ASK_CROP_PROMPTS:
             # No crop specified
-            if intent == "ask_fertilizer":
-                return "Which crop are you asking about? This helps me give specific fertilizer advice."
-            elif intent == "ask_pest":
-                return "Which crop has pests? Tell me the crop and I can recommend specific pest control."
-            elif intent == "ask_disease":
-                return "Which crop is affected? Pest management depends on the crop."
-            elif intent == "ask_irrigation":
-                return "Which crop needs irrigation? Water requirements vary by crop."
-            elif intent == "ask_planting":
-                return "Which crop are you planning to plant? Each has different planting dates & methods."
-            elif intent == "ask_harvesting":
-                return "Which crop are you harvesting? Harvest time varies significantly by crop."
-            elif intent == "ask_crop_info":
-                return "Which crop would you like to know about? Please mention the crop name."
+            return _ASK_CROP_PROMPTS[intent]
+    
+    # Misclassified intent: search across all intents before giving up
+    hits = retrieve_advice(query, None, crop, k=1)
+    if hits:
+        return hits[0]["text"]
     
     return "I couldn't understand that. Ask me about: fertilizer, pests, diseases, irrigation, planting, harvesting, or specific crops."
 
@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "retrieval")
+DEFAULT_SNIPPETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "advice_snippets.jsonl")
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "should", "the", "to", "what", "when",
+    "which", "with", "you", "your", "about", "tell", "use", "get", "there", "this", "that",
+}
+# Words that only say what kind of question it is ("fertilizer", "when to
+# plant"); a snippet matching nothing but these isn't an answer to it.
+INTENT_WORDS = frozenset({
+    "advice", "application", "apply", "best", "control", "crop", "disease", "farming", "fertilizer",
+    "fertiliser", "grow", "growing", "guide", "harvest", "harvesting", "information", "irrigation",
+    "manage", "management", "method", "option", "pest", "plant", "planting", "prevent", "prevention", "problem",
+    "recommendation", "schedule", "system", "tip", "time", "timing", "treatment", "water", "watering",
+})
+# Array files of a saved index; loaded with mmap_mode="r".
+_ARRAYS = ("postings_indptr", "postings_docs", "postings_weights", "doc_intent", "doc_crop", "text_offsets")
+
+
+def tokenize(text):
+    """Lower-case word tokens without stopwords; plurals folded to singular."""
+    tokens = []
+    for word in _WORD.findall((text or "").lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 4 and word.endswith("es") and word[-3] in "osxz":
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def load_snippets(sources=(DEFAULT_SNIPPETS,), knowledge=None):
+    """Snippet rows ``{"intent", "crop", "text"}`` from a knowledge dict and JSONL files."""
+    rows = []
+    for intent, by_crop in (knowledge or {}).items():
+        for crop, advice in by_crop.items():
+            crop = "" if crop == "default" else crop
+            text = f"{crop.capitalize()} – {advice}" if crop else advice
+            rows.append({"intent": intent, "crop": crop, "text": text})
+    for source in sources:
+        if not os.path.exists(source):
+            continue
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    rows.append({"intent": row.get("intent") or "", "crop": row.get("crop") or "",
+                                 "text": row["text"]})
+    return rows
+
+
+class RetrievalIndex:
+    """BM25 inverted index over advice snippets.
+
+    Postings are stored CSR-style: term ``t`` owns ``postings_docs`` and
+    ``postings_weights`` in ``[indptr[t], indptr[t + 1])``, with the full
+    BM25 term weight precomputed per (term, snippet). A query only touches
+    the postings of its own terms, so cost grows with how common the query
+    words are, not with the number of snippets. Saved indexes are
+    memory-mapped, so loading is instant and pages are shared between
+    processes.
+    """
+
+    def __init__(self, vocab, arrays, intents, crops, texts_blob, version):
+        self.vocab = vocab
+        self.intents = intents
+        self.crops = crops
+        self.version = version
+        self._intent_code = {intent: i for i, intent in enumerate(intents)}
+        self._crop_code = {crop: i for i, crop in enumerate(crops)}
+        self._texts = texts_blob
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_rows(cls, rows, k1=1.2, b=0.75):
+        """Build an in-memory index from snippet rows."""
+        intents = [""] + sorted({r["intent"] for r in rows} - {""})
+        crops = [""] + sorted({r["crop"] for r in rows} - {""})
+        intent_code = {intent: i for i, intent in enumerate(intents)}
+        crop_code = {crop: i for i, crop in enumerate(crops)}
+
+        vocab = {}
+        postings = []
+        lengths = np.zeros(len(rows), dtype=np.float32)
+        for doc, row in enumerate(rows):
+            # A short "Topic:" lead-in names what the snippet is about; it
+            # counts three times, like a title field.
+            title, sep, _ = row["text"].partition(":")
+            title = title if sep and len(title) <= 40 else ""
+            counts = {}
+            for token in tokenize(f"{row['crop']} {row['text']} {title} {title}"):
+                counts[token] = counts.get(token, 0) + 1
+            lengths[doc] = sum(counts.values())
+            for token, tf in counts.items():
+                postings.append((vocab.setdefault(token, len(vocab)), doc, tf))
+
+        n_docs = len(rows)
+        avg_len = float(lengths.mean()) if n_docs else 1.0
+        postings.sort()
+        terms = np.array([p[0] for p in postings], dtype=np.int64)
+        docs = np.array([p[1] for p in postings], dtype=np.int32)
+        tfs = np.array([p[2] for p in postings], dtype=np.float32)
+        df = np.bincount(terms, minlength=len(vocab)).astype(np.float32)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        weights = idf[terms] * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths[docs] / avg_len))
+
+        encoded = [r["text"].encode("utf-8") for r in rows]
+        offsets = np.zeros(n_docs + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        arrays = {
+            "postings_indptr": np.concatenate(([0], np.cumsum(df))).astype(np.int64),
+            "postings_docs": docs,
+            "postings_weights": weights.astype(np.float32),
+            "doc_intent": np.array([intent_code[r["intent"]] for r in rows], dtype=np.int32),
+            "doc_crop": np.array([crop_code[r["crop"]] for r in rows], dtype=np.int32),
+            "text_offsets": offsets,
+        }
+        version = hashlib.sha1(json.dumps(rows, sort_keys=True).encode("utf-8")).hexdigest()
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(vocab, arrays, intents, crops, blob, version)
+
+    def save(self, index_dir=DEFAULT_INDEX_DIR):
+        """Write the index files to ``index_dir``, replacing any previous index."""
+        tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), getattr(self, name))
+        np.save(os.path.join(tmp_dir, "texts.npy"), np.asarray(self._texts))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "intents": self.intents, "crops": self.crops,
+                       "vocab": self.vocab}, f)
+        old_dir = f"{index_dir}.old-{os.getpid()}"
+        if os.path.exists(index_dir):
+            os.replace(index_dir, old_dir)
+        os.replace(tmp_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return index_dir
+
+    @classmethod
+    def load(cls, index_dir=DEFAULT_INDEX_DIR):
+        """Memory-map an index written by ``save``."""
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+        texts = np.load(os.path.join(index_dir, "texts.npy"), mmap_mode="r")
+        return cls(meta["vocab"], arrays, meta["intents"], meta["crops"], texts, meta["version"])
+
+    def __len__(self):
+        return len(self.doc_intent)
+
+    def text(self, doc):
+        start, end = self.text_offsets[doc], self.text_offsets[doc + 1]
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def search(self, query, intent=None, crop=None, k=3, min_score=0.0, ignore=frozenset()):
+        """Top-``k`` snippets for ``query`` as ``{"text", "intent", "crop", "score"}`` dicts.
+
+        With ``intent``/``crop``, only snippets for that intent/crop or
+        general ones (no intent/crop) are returned; without a crop, only
+        general snippets are. Unknown intents don't filter. Query words in
+        ``ignore`` (e.g. ``INTENT_WORDS``) are dropped before matching.
+        """
+        terms = {self.vocab[t] for t in tokenize(query) if t in self.vocab and t not in ignore}
+        if not terms:
+            return []
+        indptr = self.postings_indptr
+        docs = np.concatenate([self.postings_docs[indptr[t]:indptr[t + 1]] for t in terms])
+        weights = np.concatenate([self.postings_weights[indptr[t]:indptr[t + 1]] for t in terms])
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        keep = self.doc_crop[candidates] == 0
+        if crop in self._crop_code:
+            keep |= self.doc_crop[candidates] == self._crop_code[crop]
+        if intent in self._intent_code:
+            doc_intent = self.doc_intent[candidates]
+            keep &= (doc_intent == 0) | (doc_intent == self._intent_code[intent])
+        keep &= scores >= min_score
+        candidates, scores = candidates[keep], scores[keep]
+        if not len(candidates):
+            return []
+
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {
+                "text": self.text(int(candidates[i])),
+                "intent": self.intents[self.doc_intent[candidates[i]]],
+                "crop": self.crops[self.doc_crop[candidates[i]]] or None,
+                "score": float(scores[i]),
+            }
+            for i in top
+        ]
+
+
+def load_index(index_dir=DEFAULT_INDEX_DIR, knowledge=None, sources=(DEFAULT_SNIPPETS,)):
+    """The saved index if one exists, else one built in memory from ``knowledge`` and ``sources``."""
+    if os.path.exists(os.path.join(index_dir, "meta.json")):
+        return RetrievalIndex.load(index_dir)
+    return RetrievalIndex.from_rows(load_snippets(sources, knowledge))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the advice retrieval index")
+    parser.add_argument("command", choices=["build", "search", "bench"])
+    parser.add_argument("--index-dir", default=os.environ.get("RETRIEVAL_INDEX", DEFAULT_INDEX_DIR))
+    parser.add_argument("--source", action="append", default=None,
+                        help="JSONL snippet file (repeatable; default knowledge/advice_snippets.jsonl)")
+    parser.add_argument("--no-builtin", action="store_true",
+                        help="don't include the advice built into responder.py")
+    parser.add_argument("--query", default="boron deficiency")
+    parser.add_argument("--intent", default=None)
+    parser.add_argument("--crop", default=None)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--synthetic", type=int, default=100000,
+                        help="bench: snippet count of the synthetic corpus")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from responder import _CROP_SPECIFIC_INFO
+        rows = load_snippets(args.source or [DEFAULT_SNIPPETS], None if args.no_builtin else _CROP_SPECIFIC_INFO)
+        RetrievalIndex.from_rows(rows).save(args.index_dir)
+        print(f"Indexed {len(rows)} snippets into {args.index_dir}")
+    elif args.command == "search":
+        index = RetrievalIndex.load(args.index_dir)
+        for hit in index.search(args.query, args.intent, args.crop, args.k):
+            print(f"{hit['score']:6.2f} [{hit['intent']}/{hit['crop'] or '-'}] {hit['text']}")
+    else:
+        import random
+        from entity_extractor import _CROPS
+
+        rng = random.Random(0)
+        base = load_snippets([DEFAULT_SNIPPETS])
+        rows = [dict(rng.choice(base), crop=rng.choice(_CROPS + [""] * 20)) for _ in range(args.synthetic)]
+        for row in rows:
+            row["text"] = f"{row['text']} ref{rng.randrange(10 ** 6)}"
+        started = time.perf_counter()
+        bench_dir = f"{args.index_dir}-bench"
+        RetrievalIndex.from_rows(rows).save(bench_dir)
+        print(f"Built {len(rows)}-snippet index in {time.perf_counter() - started:.1f}s")
+        index = RetrievalIndex.load(bench_dir)
+        queries = ["boron deficiency in tomato", "nematode control", "intercropping maize soybean",
+                   "how to store grain", "drip irrigation maintenance"] * 40
+        latencies = []
+        for query in queries:
+            t = time.perf_counter()
+            index.search(query, crop=rng.choice(_CROPS), k=5)
+            latencies.append(1000 * (time.perf_counter() - t))
+        latencies.sort()
+        print(f"search: mean {sum(latencies) / len(latencies):.2f}ms, "
+              f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.2f}ms")
+        shutil.rmtree(bench_dir, ignore_errors=True)
@@ -0,0 +1,181 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import metrics
+from pipeline import build_pipeline
+
+
+# Threads building answers (crop extraction, retrieval). Queries waiting on
+# the model hold no thread, so this doesn't limit how many are in flight.
+WORKER_THREADS = int(os.environ.get("SERVER_WORKER_THREADS", "8"))
+# Queries admitted (running + waiting) before new requests get a 429.
+MAX_PENDING = int(os.environ.get("SERVER_MAX_PENDING", "512"))
+# Largest accepted /query/batch request.
+MAX_BATCH = int(os.environ.get("SERVER_MAX_BATCH", "256"))
+
+
+class _Admission:
+    """Counts queries in flight; all access happens on the event loop thread."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.pending = 0
+
+    def try_acquire(self, n=1):
+        if self.pending + n > self.limit:
+            return False
+        self.pending += n
+        return True
+
+    def release(self, n=1):
+        self.pending -= n
+
+
+def _overloaded():
+    metrics.inc("server_rejected_total", "Requests rejected with 429")
+    return JSONResponse(
+        {"error": "Server is busy, please retry shortly."},
+        status_code=429,
+        headers={"Retry-After": "1"},
+    )
+
+
+async def _read_json(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def _run(request, func, *args, size=1):
+    state = request.app.state
+    if not state.admission.try_acquire(size):
+        return None
+    metrics.REGISTRY.gauge("server_pending_queries", "Queries admitted and not yet answered").set(state.admission.pending)
+    try:
+        return await func(*args, executor=state.executor)
+    finally:
+        state.admission.release(size)
+
+
+async def query(request):
+    data = await _read_json(request)
+    text = (data or {}).get("query")
+    if not isinstance(text, str) or not text.strip():
+        return JSONResponse({"error": "Body must be JSON like {\"query\": \"...\"}."}, status_code=400)
+
+    # Optional crop of the client's previous turn, for follow-up questions.
+    context_crop = data.get("context_crop")
+    if not isinstance(context_crop, str) or not context_crop.strip():
+        context_crop = None
+
+    # Optional per-request latency budget; the pipeline's default otherwise.
+    budget_ms = data.get("budget_ms")
+    if not isinstance(budget_ms, (int, float)) or isinstance(budget_ms, bool) or budget_ms <= 0:
+        budget_ms = None
+
+    # Optional region/season for regional advice (see knowledge_store.py).
+    region, season = data.get("region"), data.get("season")
+    if not isinstance(region, str) or not region.strip():
+        region = None
+    if not isinstance(season, str) or not season.strip():
+        season = None
+
+    result = await _run(request, request.app.state.pipeline.answer_async, text, context_crop, budget_ms,
+                        region, season)
+    if result is None:
+        return _overloaded()
+    return JSONResponse(result)
+
+
+async def query_batch(request):
+    data = await _read_json(request)
+    texts = (data or {}).get("queries")
+    if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+        return JSONResponse({"error": "Body must be JSON like {\"queries\": [\"...\", ...]}."}, status_code=400)
+    if len(texts) > MAX_BATCH:
+        return JSONResponse({"error": f"At most {MAX_BATCH} queries per batch."}, status_code=413)
+
+    results = await _run(request, request.app.state.pipeline.answer_batch_async, texts, size=len(texts))
+    if results is None:
+        return _overloaded()
+    return JSONResponse({"results": results})
+
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def ready(request):
+    pipeline = request.app.state.pipeline
+    is_ready = pipeline.is_ready()
+    error = pipeline.load_error()
+    body = {
+        "ready": is_ready,
+        "status": "ready" if is_ready else "failed" if error else "loading",
+        "pending": request.app.state.admission.pending,
+    }
+    if error:
+        body["error"] = error
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+async def profile_endpoint(request):
+    """GET the profiler settings and saved captures; POST to change settings."""
+    profiler = getattr(request.app.state.pipeline, "profiler", None)
+    if profiler is None:
+        return JSONResponse({"error": "Profiling is off; set PROFILE_DIR to enable it."}, status_code=404)
+    if request.method == "POST":
+        data = await _read_json(request)
+        if data is None:
+            return JSONResponse({"error": "Body must be a JSON object."}, status_code=400)
+        try:
+            profiler.configure(data.get("enabled"), data.get("sample_rate"), data.get("slow_ms"))
+        except (TypeError, ValueError) as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(dict(profiler.settings(), captures=profiler.captures()[:20]))
+
+
+def create_app(pipeline_factory=build_pipeline):
+    """Build the ASGI app; ``pipeline_factory`` runs once at startup."""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.pipeline = pipeline_factory()
+        app.state.executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="query")
+        app.state.admission = _Admission(MAX_PENDING)
+        try:
+            yield
+        finally:
+            app.state.executor.shutdown(wait=False)
+
+    return Starlette(
+        routes=[
+            Route("/query", query, methods=["POST"]),
+            Route("/query/batch", query_batch, methods=["POST"]),
+            Route("/health", health),
+            Route("/ready", ready),
+            Route("/metrics", metrics_endpoint),
+            Route("/debug/profile", profile_endpoint, methods=["GET", "POST"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
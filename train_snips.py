@@ -1,22 +1,63 @@
 import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, Trainer, TrainingArguments
-from datasets import load_dataset, Dataset, DatasetDict
+from transformers import (
+    AutoTokenizer,
+    AutoModelForSequenceClassification,
+    DataCollatorWithPadding,
+    Trainer,
+    TrainerCallback,
+    TrainingArguments,
+)
+from datasets import load_dataset, load_from_disk, Dataset, DatasetDict
 import numpy as np
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+import argparse
+import hashlib
 import json
 import os
+import time
+
+from batching import length_buckets
+
+
+_TOKENIZED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "tokenized")
+
+
+class EpochTimer(TrainerCallback):
+    """Records wall-clock time and training samples/sec for every epoch."""
+
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        self.epochs = []
+        self._started = None
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self._started = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self._started
+        self.epochs.append({
+            "epoch": len(self.epochs) + 1,
+            "seconds": round(seconds, 3),
+            "samples_per_sec": round(self.num_samples / seconds, 2),
+        })
+        print(f"Epoch {len(self.epochs)}: {seconds:.1f}s, {self.num_samples / seconds:.1f} samples/sec")
 
 
 class FarmingIntentClassifier:
     """Fine-tuned intent classifier using farming dataset."""
 
-    def __init__(self, model_name="distilbert-base-uncased", num_labels=7):
+    def __init__(self, model_name="distilbert-base-uncased", num_labels=7, max_length=128):
         self.model_name = model_name
         self.num_labels = num_labels
+        self.max_length = max_length
         self.tokenizer = None
         self.model = None
         self.label_to_intent = {}
         self.intent_to_label = {}
+        self.data_hash = None
+        self.training_stats = {}
+        # Traced models expect fixed-shape inputs.
+        self.pad_to_max_length = False
 
     def load_farming_data(self):
         """Load custom farming dataset."""
@@ -43,6 +84,9 @@ class FarmingIntentClassifier:
         self.num_labels = len(intents)
 
         print(f"Found {self.num_labels} intents: {list(self.label_to_intent.values())}")
+        self.data_hash = hashlib.sha1(
+            json.dumps([train_data, val_data, test_data], sort_keys=True).encode("utf-8")
+        ).hexdigest()
 
         # ✅ CONVERT TO DatasetDict (THIS IS THE FIX)
         dataset = DatasetDict({
@@ -53,19 +97,46 @@ class FarmingIntentClassifier:
 
         return dataset
 
-    def preprocess_function(self, examples):
-        """Tokenize and encode the text."""
-        return self.tokenizer(
+    def preprocess_function(self, examples, pad_to_max_length=False):
+        """Tokenize the text and encode intents as labels in one pass.
+
+        Padding is left to the collator, so each batch is padded only to its
+        own longest example, unless ``pad_to_max_length`` is set.
+        """
+        encoded = self.tokenizer(
             examples["text"],
             truncation=True,
-            padding="max_length",
-            max_length=128
+            padding="max_length" if pad_to_max_length else False,
+            max_length=self.max_length
         )
-
-    def encode_labels(self, examples):
-        """Convert intent strings to integers."""
-        examples["label"] = [self.intent_to_label[intent] for intent in examples["intent"]]
-        return examples
+        encoded["label"] = [self.intent_to_label[intent] for intent in examples["intent"]]
+        return encoded
+
+    def tokenize_dataset(self, dataset, use_cache=True, pad_to_max_length=False):
+        """Tokenized dataset, reused from disk when tokenizer and data are unchanged."""
+        key = hashlib.sha1(json.dumps({
+            "tokenizer": self.tokenizer.name_or_path,
+            "tokenizer_class": type(self.tokenizer).__name__,
+            "vocab_size": len(self.tokenizer),
+            "max_length": self.max_length,
+            "padded": pad_to_max_length,
+            "labels": self.intent_to_label,
+            "data": self.data_hash,
+        }, sort_keys=True).encode("utf-8")).hexdigest()
+        cache_path = os.path.join(_TOKENIZED_CACHE_DIR, key)
+        if use_cache and os.path.isdir(cache_path):
+            print(f"Using cached tokenized dataset {cache_path}")
+            return load_from_disk(cache_path)
+
+        encoded_dataset = dataset.map(
+            self.preprocess_function,
+            batched=True,
+            fn_kwargs={"pad_to_max_length": pad_to_max_length},
+            remove_columns=dataset["train"].column_names,
+        )
+        if use_cache:
+            encoded_dataset.save_to_disk(cache_path)
+        return encoded_dataset
 
     def compute_metrics(self, eval_pred):
         """Compute accuracy, precision, recall, F1."""
@@ -84,8 +155,16 @@ class FarmingIntentClassifier:
             "f1": f1
         }
 
-    def train(self, output_dir="./farming_model", epochs=10, batch_size=8):
-        """Fine-tune the model on farming dataset."""
+    def train(self, output_dir="./farming_model", epochs=10, batch_size=8, dataloader_workers=0,
+              use_cache=True, fast=True):
+        """Fine-tune the model on farming dataset.
+
+        With ``fast`` (the default) tokenization is cached on disk, batches
+        are padded dynamically and examples of similar length are grouped
+        together. ``fast=False`` reproduces the old fixed 128-token padding
+        for before/after comparisons. Per-epoch timings end up in
+        ``training_stats`` and ``training_stats.json``.
+        """
         print("Setting up tokenizer and model...")
 
         # Load tokenizer and model
@@ -99,14 +178,17 @@ class FarmingIntentClassifier:
         dataset = self.load_farming_data()
 
         print("Preprocessing data...")
-        encoded_dataset = dataset.map(self.preprocess_function, batched=True)
-        encoded_dataset = encoded_dataset.map(self.encode_labels, batched=True)
-
-        # Set format for PyTorch
-        encoded_dataset.set_format(
-            type="torch",
-            columns=["input_ids", "attention_mask", "label"]
+        started = time.perf_counter()
+        encoded_dataset = self.tokenize_dataset(
+            dataset, use_cache=use_cache and fast, pad_to_max_length=not fast
         )
+        preprocess_seconds = time.perf_counter() - started
+
+        # Length-grouped sampling; transformers 5 renamed the option.
+        if "train_sampling_strategy" in TrainingArguments.__dataclass_fields__:
+            sampling = {"train_sampling_strategy": "group_by_length" if fast else "random"}
+        else:
+            sampling = {"group_by_length": fast}
 
         # Training arguments - improved for better convergence
         training_args = TrainingArguments(
@@ -125,19 +207,31 @@ class FarmingIntentClassifier:
             metric_for_best_model="accuracy",
             greater_is_better=True,
             gradient_accumulation_steps=2,
+            dataloader_num_workers=dataloader_workers,
+            **sampling,
         )
 
         # Trainer
+        timer = EpochTimer(len(encoded_dataset["train"]))
         trainer = Trainer(
             model=self.model,
             args=training_args,
             train_dataset=encoded_dataset["train"],
             eval_dataset=encoded_dataset["validation"],
+            data_collator=DataCollatorWithPadding(self.tokenizer),
             compute_metrics=self.compute_metrics,
+            callbacks=[timer],
         )
 
         print("Starting training...")
-        trainer.train()
+        train_output = trainer.train()
+        self.training_stats = {
+            "fast": fast,
+            "preprocess_seconds": round(preprocess_seconds, 3),
+            "train_seconds": round(train_output.metrics["train_runtime"], 3),
+            "train_samples_per_sec": round(train_output.metrics["train_samples_per_second"], 2),
+            "epochs": timer.epochs,
+        }
 
         # Save model
         print(f"Saving model to {output_dir}")
@@ -154,6 +248,8 @@ class FarmingIntentClassifier:
                 f,
                 indent=2
             )
+        with open(os.path.join(output_dir, "training_stats.json"), "w") as f:
+            json.dump(self.training_stats, f, indent=2)
 
         return trainer
 
@@ -176,44 +272,135 @@ class FarmingIntentClassifier:
         self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
         self.model = AutoModelForSequenceClassification.from_pretrained(model_dir)
 
+    def optimize(self, variant="inference_mode"):
+        """Switch a loaded model to a faster inference variant.
+
+        ``"torchscript"`` traces and freezes the model (inputs are then
+        padded to ``max_length``), ``"compile"`` wraps it in
+        ``torch.compile``; ``"inference_mode"`` keeps the eager model.
+        """
+        if variant == "inference_mode":
+            return
+        self.model.eval()
+        if variant == "compile":
+            self.model = torch.compile(self.model)
+        elif variant == "torchscript":
+            self.model.config.torchscript = True
+            example = self.tokenizer(["example query"], return_tensors="pt", padding="max_length",
+                                     truncation=True, max_length=self.max_length)
+            with torch.inference_mode():
+                traced = torch.jit.trace(self.model, (example["input_ids"], example["attention_mask"]), strict=False)
+            self.model = _TracedModel(torch.jit.freeze(traced))
+            self.pad_to_max_length = True
+        else:
+            raise ValueError(f"Unknown inference variant {variant!r}")
+
     def predict(self, text):
         """Predict intent for a given text."""
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts, batch_size=32):
+        """Predict intents for many texts.
+
+        Texts are grouped by length and each batch is padded only to its
+        longest member (capped at ``max_length``). Results are returned in
+        the original order.
+        """
         if self.model is None or self.tokenizer is None:
             raise ValueError("Model not loaded. Call load_model() first.")
 
-        inputs = self.tokenizer(
-            text,
-            return_tensors="pt",
-            truncation=True,
-            padding="max_length",
-            max_length=128
-        )
+        texts = list(texts)
+        results = [None] * len(texts)
+        for indices in length_buckets(texts, batch_size):
+            inputs = self.tokenizer(
+                [texts[i] for i in indices],
+                return_tensors="pt",
+                truncation=True,
+                padding="max_length" if self.pad_to_max_length else True,
+                max_length=self.max_length
+            )
 
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            logits = outputs.logits
-            probabilities = torch.softmax(logits, dim=1)
-            predicted_class = torch.argmax(probabilities, dim=1).item()
-            confidence = probabilities[0][predicted_class].item()
+            with torch.inference_mode():
+                logits = self.model(**inputs).logits
+                probabilities = torch.softmax(logits, dim=1)
 
-        intent = self.label_to_intent[predicted_class]
+            for i, probs in zip(indices, probabilities):
+                predicted_class = torch.argmax(probs).item()
+                all_probs = probs.tolist()
+                results[i] = {
+                    "intent": self.label_to_intent[predicted_class],
+                    "score": all_probs[predicted_class],
+                    "all": list(zip(
+                        [self.label_to_intent[j] for j in range(len(all_probs))],
+                        all_probs
+                    ))
+                }
+        return results
 
-        all_probs = probabilities[0].tolist()
-        all_intents_scores = list(zip(
-            [self.label_to_intent[i] for i in range(len(all_probs))],
-            all_probs
-        ))
 
-        return {
-            "intent": intent,
-            "score": confidence,
-            "all": all_intents_scores
-        }
+class _TracedModel:
+    """Calls a traced model like the Hugging Face one (keyword inputs, ``.logits``)."""
+
+    def __init__(self, traced):
+        self.traced = traced
+
+    def __call__(self, input_ids, attention_mask, **_):
+        return _Logits(self.traced(input_ids, attention_mask)[0])
+
+    def parameters(self):
+        return self.traced.parameters()
+
+
+class _Logits:
+    __slots__ = ("logits",)
+
+    def __init__(self, logits):
+        self.logits = logits
+
+
+def compare_training(epochs=3, batch_size=16, dataloader_workers=0):
+    """Train once with fixed padding and once with the fast path; print timings."""
+    stats = {}
+    for fast in (False, True):
+        classifier = FarmingIntentClassifier()
+        classifier.train(
+            output_dir=f"./farming_model_{'fast' if fast else 'padded'}",
+            epochs=epochs, batch_size=batch_size,
+            dataloader_workers=dataloader_workers, fast=fast,
+        )
+        stats["fast" if fast else "padded"] = classifier.training_stats
+
+    print(f"{'':8s} {'preprocess s':>12s} {'train s':>9s} {'samples/s':>10s} {'s/epoch':>9s}")
+    for name, run in stats.items():
+        per_epoch = sum(e["seconds"] for e in run["epochs"]) / max(1, len(run["epochs"]))
+        print(f"{name:8s} {run['preprocess_seconds']:12.2f} {run['train_seconds']:9.1f} "
+              f"{run['train_samples_per_sec']:10.1f} {per_epoch:9.2f}")
+    return stats
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune DistilBERT on the farming dataset")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--output-dir", default="./farming_model")
+    parser.add_argument("--dataloader-workers", type=int, default=0)
+    parser.add_argument("--no-cache", action="store_true", help="re-tokenize even if a cached copy exists")
+    parser.add_argument("--compare", action="store_true",
+                        help="time fixed 128-token padding against the fast path")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_training(args.epochs, args.batch_size, args.dataloader_workers)
+        raise SystemExit
+
     classifier = FarmingIntentClassifier()
-    classifier.train(epochs=5, batch_size=16)
+    classifier.train(
+        output_dir=args.output_dir,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        dataloader_workers=args.dataloader_workers,
+        use_cache=not args.no_cache,
+    )
 
     test_texts = [
         "What's the best fertilizer for maize?",